@@ -11,18 +11,23 @@ first define some imports that we'll need:
 
 # Python native libs
 import os
+import sys
 import enum
 from collections import namedtuple
 import argparse
 import numbers
 import math
+import hashlib
+import inspect
+import threading
+import queue
+from typing import List
 
 
 # Deep learning related imports
 import torch
 import torch.nn as nn
 from torchvision import models
-from torchvision import transforms
 import torch.nn.functional as F
 
 
@@ -65,6 +70,13 @@ os.makedirs(OUT_IMAGES_PATH, exist_ok=True)
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # checking whether you have a GPU
 
+# On the GPU the model runs purely in bfloat16 (tensor cores, half the activation memory), the image itself stays in float32
+# bfloat16 has the same exponent range as float32 so no gradient scaling is needed
+MODEL_DTYPE = torch.bfloat16 if DEVICE.type == 'cuda' else torch.float32
+
+# The input shape stays the same for all iterations (and usually all images), so let cuDNN pick the fastest conv algorithms once
+torch.backends.cudnn.benchmark = True
+
 # Images will be normalized using these, because the CNNs were trained with normalized images as well!
 IMAGENET_MEAN_1 = np.array([0.485, 0.456, 0.406], dtype=np.float32)
 IMAGENET_STD_1 = np.array([0.229, 0.224, 0.225], dtype=np.float32)
@@ -89,41 +101,9 @@ class Vgg16Experimental(torch.nn.Module):
         # https://github.com/pytorch/vision/blob/master/torchvision/models/vgg.py
         vgg_pretrained_features = vgg16.features
 
-        # I've exposed the best/most interesting layers in my subjective opinion (mp5 is not that good though)
-        self.layer_names = ['relu3_3', 'relu4_1', 'relu4_2', 'relu4_3', 'relu5_1', 'relu5_2', 'relu5_3', 'mp5']
-
-        # 31 layers in total for the VGG16
-        self.conv1_1 = vgg_pretrained_features[0]
-        self.relu1_1 = vgg_pretrained_features[1]
-        self.conv1_2 = vgg_pretrained_features[2]
-        self.relu1_2 = vgg_pretrained_features[3]
-        self.max_pooling1 = vgg_pretrained_features[4]
-        self.conv2_1 = vgg_pretrained_features[5]
-        self.relu2_1 = vgg_pretrained_features[6]
-        self.conv2_2 = vgg_pretrained_features[7]
-        self.relu2_2 = vgg_pretrained_features[8]
-        self.max_pooling2 = vgg_pretrained_features[9]
-        self.conv3_1 = vgg_pretrained_features[10]
-        self.relu3_1 = vgg_pretrained_features[11]
-        self.conv3_2 = vgg_pretrained_features[12]
-        self.relu3_2 = vgg_pretrained_features[13]
-        self.conv3_3 = vgg_pretrained_features[14]
-        self.relu3_3 = vgg_pretrained_features[15]
-        self.max_pooling3 = vgg_pretrained_features[16]
-        self.conv4_1 = vgg_pretrained_features[17]
-        self.relu4_1 = vgg_pretrained_features[18]
-        self.conv4_2 = vgg_pretrained_features[19]
-        self.relu4_2 = vgg_pretrained_features[20]
-        self.conv4_3 = vgg_pretrained_features[21]
-        self.relu4_3 = vgg_pretrained_features[22]
-        self.max_pooling4 = vgg_pretrained_features[23]
-        self.conv5_1 = vgg_pretrained_features[24]
-        self.relu5_1 = vgg_pretrained_features[25]
-        self.conv5_2 = vgg_pretrained_features[26]
-        self.relu5_2 = vgg_pretrained_features[27]
-        self.conv5_3 = vgg_pretrained_features[28]
-        self.relu5_3 = vgg_pretrained_features[29]
-        self.max_pooling5 = vgg_pretrained_features[30]
+        # 31 layers in total for the VGG16 (conv/relu pairs, max pooling after each block)
+        # the last max pooling (mp5) was never exposed so we stop at relu5_3 and return its output
+        self.features = vgg_pretrained_features[:30]
 
         # Turn off these because we'll be using a pretrained network
         # if we didn't do this PyTorch would be saving gradients and eating up precious memory!
@@ -131,7 +111,7 @@ class Vgg16Experimental(torch.nn.Module):
             for param in self.parameters():
                 param.requires_grad = False
                 
-        # prepare layer names and layer outputs
+        # prepare layer names and the indices of the layers in self.features whose outputs are exposed
         self.layer_names = ["conv1_1", 
                             "conv1_2", 
                             "conv2_1", 
@@ -145,95 +125,50 @@ class Vgg16Experimental(torch.nn.Module):
                             "conv5_1",
                             "conv5_2",
                             "conv5_3"]
+        layer_indices = [0, 2, 5, 7, 10, 12, 14, 17, 19, 21, 24, 26, 28]
+        
+        self._capture = dict(zip(layer_indices, self.layer_names))
         
-        self.layer_outputs  = {}
-        for layer_name in self.layer_names:
-            self.layer_outputs[layer_name] = None
+        self._layer_index = dict(zip(self.layer_names, layer_indices))
         
+        # by default every layer is exposed, keeping references to the outputs of unused layers wastes a lot of memory though
+        self._capture_names = list(self.layer_names)
+        self._stop_index = len(self.features) - 1
+
+    # Only expose the outputs of these layers during the forward pass
+    # layers after the deepest of them don't contribute to the outputs, so they aren't run at all
+    # (except for the ReLU right after it, VGG16 applies it in place to the exposed conv output)
+    @torch.jit.export
+    def set_capture_set(self, layer_names: List[str]):
+        # the names are validated before anything is changed, so invalid names leave the previous capture set intact
+        if len(layer_names) == 0:
+            raise ValueError('No layer names given')
+        stop_index = -1
+        for layer_name in layer_names:
+            if layer_name not in self._layer_index:
+                raise ValueError('Unknown layer name ' + layer_name)
+            stop_index = max(stop_index, self._layer_index[layer_name])
+        
+        self._capture_names = layer_names
+        self._stop_index = stop_index + 1
 
-    # Just expose every single layer during the forward pass
     def forward(self, x):
-        x = self.conv1_1(x)
-        conv1_1 = x
-        self.layer_outputs["conv1_1"] = x
-        x = self.relu1_1(x)
-        relu1_1 = x
-        x = self.conv1_2(x)
-        conv1_2 = x
-        self.layer_outputs["conv1_2"] = x
-        x = self.relu1_2(x)
-        relu1_2 = x
-        x = self.max_pooling1(x)
-        x = self.conv2_1(x)
-        conv2_1 = x
-        self.layer_outputs["conv2_1"] = x
-        x = self.relu2_1(x)
-        relu2_1 = x
-        x = self.conv2_2(x)
-        conv2_2 = x
-        self.layer_outputs["conv2_2"] = x
-        x = self.relu2_2(x)
-        relu2_2 = x
-        x = self.max_pooling2(x)
-        x = self.conv3_1(x)
-        conv3_1 = x
-        self.layer_outputs["conv3_1"] = x
-        x = self.relu3_1(x)
-        relu3_1 = x
-        x = self.conv3_2(x)
-        conv3_2 = x
-        self.layer_outputs["conv3_2"] = x
-        x = self.relu3_2(x)
-        relu3_2 = x
-        x = self.conv3_3(x)
-        conv3_3 = x
-        self.layer_outputs["conv3_3"] = x
-        x = self.relu3_3(x)
-        relu3_3 = x
-        x = self.max_pooling3(x)
-        x = self.conv4_1(x)
-        conv4_1 = x
-        self.layer_outputs["conv4_1"] = x
-        x = self.relu4_1(x)
-        relu4_1 = x
-        x = self.conv4_2(x)
-        conv4_2 = x
-        self.layer_outputs["conv4_2"] = x
-        x = self.relu4_2(x)
-        relu4_2 = x
-        x = self.conv4_3(x)
-        conv4_3 = x
-        self.layer_outputs["conv4_3"] = x
-        x = self.relu4_3(x)
-        relu4_3 = x
-        x = self.max_pooling4(x)
-        x = self.conv5_1(x)
-        conv5_1 = x
-        self.layer_outputs["conv5_1"] = x
-        x = self.relu5_1(x)
-        relu5_1 = x
-        x = self.conv5_2(x)
-        conv5_2 = x
-        self.layer_outputs["conv5_2"] = x
-        x = self.relu5_2(x)
-        relu5_2 = x
-        x = self.conv5_3(x)
-        conv5_3 = x
-        self.layer_outputs["conv5_3"] = x
-        x = self.relu5_3(x)
-        relu5_3 = x
-        mp5 = self.max_pooling5(x)
-
-        # Finally, expose only the layers that you want to experiment with here
-        #vgg_outputs = namedtuple("VggOutputs", self.layer_names)
-        #out = vgg_outputs(relu3_3, relu4_1, relu4_2, relu4_3, relu5_1, relu5_2, relu5_3, mp5)
-
-        return x, self.layer_outputs
+        layer_outputs = {}
+        for layer_index, layer in enumerate(self.features):
+            # TorchScript unrolls loops over modules and doesn't support break, hence the check on every layer
+            if layer_index <= self._stop_index:
+                x = layer(x)
+                if layer_index in self._capture:
+                    layer_name = self._capture[layer_index]
+                    if layer_name in self._capture_names:
+                        layer_outputs[layer_name] = x
+
+        return x, layer_outputs
     
     
 def fetch_and_prepare_model(model_type, pretrained_weights):
     if model_type == SupportedModels.VGG16_EXPERIMENTAL.name:
-        model = Vgg16Experimental(pretrained_weights, requires_grad=False, show_progress=True).to(DEVICE)
+        model = Vgg16Experimental(pretrained_weights, requires_grad=False, show_progress=True).to(DEVICE, dtype=MODEL_DTYPE, memory_format=torch.channels_last)
     elif model_type == SupportedModels.RESNET50.name:
         # We'll define the ResNet50 later
         #model = ResNet50(pretrained_weights, requires_grad=False, show_progress=True).to(DEVICE)
@@ -243,6 +178,38 @@ def fetch_and_prepare_model(model_type, pretrained_weights):
     return model
 
 
+# The same forward graph runs for every iteration of every pyramid level, so it is compiled once with TorchScript
+# Note: torch.compile isn't used, its graphs are guarded on the python attributes that set_capture_set changes, so every
+# new capture set (e.g. in the layer sweep) would compile again and after cache_size_limit silently run eagerly.
+# The scripted model reads these attributes at run time, so one compiled model serves all capture sets.
+def compile_model(model):
+    return torch.jit.script(model.eval())
+
+
+# The scripted model is saved to the binaries dir, later runs load it directly
+# instead of building the torchvision model and scripting it again
+# Note: the model is scripted and not traced, a trace would freeze the layers that set_capture_set selects
+def fetch_and_compile_model(model_type, pretrained_weights):
+    # the file name contains the torch version and a hash of the model code, so a changed model is scripted again
+    # instead of silently loading the old one
+    try:
+        code_hash = hashlib.sha1(inspect.getsource(Vgg16Experimental).encode()).hexdigest()[:10]
+    except (OSError, TypeError):  # no source available (e.g. in an interactive session), so nothing is cached
+        return compile_model(fetch_and_prepare_model(model_type, pretrained_weights))
+    
+    dtype_name = str(MODEL_DTYPE).split('.')[-1]
+    script_path = os.path.join(BINARIES_PATH, f'{model_type}_{pretrained_weights}_{dtype_name}_{DEVICE.type}_torch{torch.__version__}_{code_hash}.pt')
+    if os.path.exists(script_path):
+        try:
+            return torch.jit.load(script_path, map_location=DEVICE).eval()
+        except Exception as e:  # e.g. a damaged file, build the model again and overwrite it
+            print(f'Could not load {script_path} ({e}), scripting the model again.')
+
+    model = compile_model(fetch_and_prepare_model(model_type, pretrained_weights))
+    torch.jit.save(model, script_path)
+    return model
+
+
 
 
 
@@ -254,20 +221,25 @@ Let's now define some image utility functions that will handle data (images) loa
 def load_image(img_path, target_shape=None):
     if not os.path.exists(img_path):
         raise Exception(f'Path does not exist: {img_path}')
-    img = cv.imread(img_path)[:, :, ::-1]  # [:, :, ::-1] converts BGR (opencv format...) into RGB
+    img = cv.imread(img_path)
+    if img is None:
+        raise Exception(f'Could not read image: {img_path}')
+    img = cv.cvtColor(img, cv.COLOR_BGR2RGB)  # converts BGR (opencv format...) into a contiguous RGB image
 
     if target_shape is not None:  # resize section
+        current_height, current_width = img.shape[:2]
         if isinstance(target_shape, int) and target_shape != -1:  # scalar -> implicitly setting the width
-            current_height, current_width = img.shape[:2]
             new_width = target_shape
             new_height = int(current_height * (new_width / current_width))
-            img = cv.resize(img, (new_width, new_height), interpolation=cv.INTER_CUBIC)
         else:  # set both dimensions to target shape
-            img = cv.resize(img, (target_shape[1], target_shape[0]), interpolation=cv.INTER_CUBIC)
+            new_height, new_width = target_shape[0], target_shape[1]
+        # INTER_AREA is faster and doesn't alias when shrinking, INTER_CUBIC looks better when enlarging
+        interpolation = cv.INTER_AREA if new_width < current_width else cv.INTER_CUBIC
+        img = cv.resize(img, (new_width, new_height), interpolation=interpolation)
 
     # This need to go after resizing - otherwise cv.resize will push values outside of [0,1] range
     img = img.astype(np.float32)  # convert from uint8 to float32
-    img /= 255.0  # get to [0, 1] range
+    np.multiply(img, 1.0 / 255.0, out=img)  # get to [0, 1] range
     return img
 
 
@@ -343,30 +315,22 @@ Now before jumping straight into the core of the algorithm let's define a couple
 
 # mean/std normalization - ImageNet's mean and std capture the statistics of natural images pretty nicely.
 # This works for Places365 dataset as well (keep in mind you might have to change it if your dataset is way different)
-def pre_process_numpy_img(img):
-    assert isinstance(img, np.ndarray), f'Expected numpy image got {type(img)}'
-
-    img = (img - IMAGENET_MEAN_1) / IMAGENET_STD_1  # normalize image
-    return img
-
-
-def post_process_numpy_img(img):
-    assert isinstance(img, np.ndarray), f'Expected numpy image got {type(img)}'
-
-    if img.shape[0] == 3:  # if channel-first format move to channel-last (CHW -> HWC)
-        img = np.moveaxis(img, 0, 2)
-
-    mean = IMAGENET_MEAN_1.reshape(1, 1, -1)
-    std = IMAGENET_STD_1.reshape(1, 1, -1)
-    img = (img * std) + mean  # de-normalize
-    img = np.clip(img, 0., 1.)  # make sure it's in the [0, 1] range
-
-    return img
+# The (de-)normalization is done on the device tensors, shape = (1, 3, 1, 1) so they broadcast over (1, 3, H, W)
+IMAGENET_MEAN_TENSOR = torch.tensor(IMAGENET_MEAN_1, device=DEVICE).view(1, -1, 1, 1)
+IMAGENET_STD_TENSOR = torch.tensor(IMAGENET_STD_1, device=DEVICE).view(1, -1, 1, 1)
 
 
 def pytorch_input_adapter(img):
-    # shape = (1, 3, H, W)
-    tensor = transforms.ToTensor()(img).to(DEVICE).unsqueeze(0)
+    # shape = (N, 3, H, W) for a (N, H, W, 3) batch of images or (1, 3, H, W) for a single (H, W, 3) image
+    # a permuted view of the images is already channels-last (NHWC) which lets cuDNN pick its faster convolution kernels
+    if img.ndim == 3:
+        img = img[np.newaxis]
+    tensor = torch.from_numpy(np.ascontiguousarray(img)).permute(0, 3, 1, 2)
+    if DEVICE.type == 'cuda':
+        tensor = tensor.pin_memory()  # page-locked memory so the copy to the GPU can run asynchronously
+    tensor = tensor.to(DEVICE, non_blocking=True)
+    tensor = (tensor - IMAGENET_MEAN_TENSOR) / IMAGENET_STD_TENSOR  # normalize image
+    tensor = tensor.contiguous(memory_format=torch.channels_last)
     tensor.requires_grad = True  # we need to collect gradients for the input image
     return tensor
 
@@ -375,8 +339,11 @@ def pytorch_output_adapter(tensor):
     
     #print("pytorch_output_adapter min ", torch.min(tensor), " max ", torch.max(tensor))
     
-    # Push to CPU, detach from the computational graph, convert from (1, 3, H, W) tensor into (H, W, 3) numpy image
-    return np.moveaxis(tensor.to('cpu').detach().numpy()[0], 0, 2)
+    tensor = tensor.detach() * IMAGENET_STD_TENSOR + IMAGENET_MEAN_TENSOR  # de-normalize
+    tensor = torch.clamp(tensor, 0., 1.)  # make sure it's in the [0, 1] range
+
+    # Push to CPU, convert from (N, 3, H, W) tensor into a list of N (H, W, 3) numpy images
+    return [np.moveaxis(img.numpy(), 0, 2) for img in torch.unbind(tensor.to('cpu'))]
 
 
 # Adds stochasticity to the algorithm and makes the results more diverse
@@ -384,10 +351,11 @@ def random_circular_spatial_shift(tensor, h_shift, w_shift, should_undo=False):
     if should_undo:
         h_shift = -h_shift
         w_shift = -w_shift
-    with torch.no_grad():
-        rolled = torch.roll(tensor, shifts=(h_shift, w_shift), dims=(2, 3))
-        rolled.requires_grad = True
-        return rolled
+    # Roll the data of the same leaf tensor, so it (and its gradient buffer) are reused across iterations
+    tensor.data = torch.roll(tensor.data, shifts=(h_shift, w_shift), dims=(2, 3))
+    if tensor.grad is None:
+        tensor.grad = torch.zeros_like(tensor.data)
+    return tensor
 
 """
 Image pyramid
@@ -427,33 +395,93 @@ DeepDream core algorithm¶
 So this is the core part. Take some time to understand what is happening. We'll define gradient_ascent in the next cell.
 """
 
+# The image to start dreaming from, either the provided image or a pure noise image of the same shape
+def load_input_image(config):
+    img_path = os.path.join(INPUT_DATA_PATH, config['input'])
+    # load a numpy, [0, 1] range, channel-last, RGB image
+    img = load_image(img_path, target_shape=config['img_width'])
+    if config['use_noise']:
+        shape = img.shape
+        img = np.random.uniform(low=0.0, high=1.0, size=shape).astype(np.float32)
+    return img
+
+
 def deep_dream_static_image(config, img=None):
 
+    if img is None:
+        img = load_input_image(config)
+
+    imgs = deep_dream_static_batch(config, [img])
+    return imgs[0] if imgs is not None else None
+
+
+# Dreams a list of images with the same shape at once, which keeps the GPU a lot busier than dreaming them one by one
+# The loss of each image only depends on that image and the gradients are normalized per image,
+# so the results are the same as for deep_dream_static_image
+# An entry of config['features_to_use'] can also be a list with a different feature index for every image of the batch
+def deep_dream_static_batch(config, img_list):
+    runner = make_runner(config)
+    return runner(img_list) if runner is not None else None
+
+
+# Does the per run setup once (layer validation and the Gaussian smoothing kernels) and returns a function that
+# dreams a list of images with these settings, use it when dreaming many images with the same config
+def make_runner(config):
+
     try:
         layers_to_use = [layer_name for layer_name in config['layers_to_use']]
         features_to_use = [feature_index for feature_index in config['features_to_use']]
+        # only run the model up to the deepest of these layers (this fails for unknown layer names)
+        model.set_capture_set(layers_to_use)
     except Exception as e:  # making sure you set the correct layer name for this specific model
         print(f'Invalid layer names {[layer_name for layer_name in config["layers_to_use"]]}.')
         print(f'Available layers for model {config["model_name"]} are {model.layer_names}.')
         return
 
-    if img is None:  # load either the provided image or start from a pure noise image
-        img_path = os.path.join(INPUT_DATA_PATH, config['input'])
-        # load a numpy, [0, 1] range, channel-last, RGB image
-        img = load_image(img_path, target_shape=config['img_width'])
-        if config['use_noise']:
-            shape = img.shape
-            img = np.random.uniform(low=0.0, high=1.0, size=shape).astype(np.float32)
+    # The smoothing sigma only depends on the iteration, so build the Gaussian kernels once instead of every iteration
+    smoothers = [build_gradient_smoother(config, iteration) for iteration in range(config['num_gradient_ascent_iterations'])]
+
+    def runner(img_list):
+        # the capture set is shared by all runners, so set it again in case another runner was used in between
+        model.set_capture_set(layers_to_use)
+        return dream_batch(config, img_list, layers_to_use, features_to_use, smoothers)
+
+    return runner
+
+
+def dream_batch(config, img_list, layers_to_use, features_to_use, smoothers):
 
-    img = pre_process_numpy_img(img)
-    original_shape = img.shape[:-1]  # save initial height and width
+    imgs = np.stack(img_list)  # shape = (N, H, W, 3)
+    original_shape = imgs.shape[1:-1]  # save initial height and width
+
+    # (layer, feature) pairs whose activations we maximize, these are fixed for the whole run
+    # per image features are turned into (image indices, feature indices) tensors for advanced indexing
+    image_indices = torch.arange(len(img_list), device=DEVICE)
+    feature_slices = []
+    for layer_to_use, feature_to_use in zip(layers_to_use, features_to_use):
+        if not isinstance(feature_to_use, numbers.Number):
+            feature_to_use = (image_indices, torch.tensor(feature_to_use, device=DEVICE))
+        feature_slices.append((layer_to_use, feature_to_use))
+
+    # Draw the random shifts for every iteration of every pyramid level at once (no shifting at all if the size is 0)
+    spatial_shift_size = int(config['spatial_shift_size'])
+    shifts_shape = (config['pyramid_size'], config['num_gradient_ascent_iterations'], 2)
+    shifts = np.random.default_rng().integers(-spatial_shift_size, spatial_shift_size + 1, size=shifts_shape)
+
+    input_tensor = pytorch_input_adapter(imgs)  # convert to trainable tensor, it stays on the device for all pyramid levels
 
     # Note: simply rescaling the whole result (and not only details, see original implementation) gave me better results
     # Going from smaller to bigger resolution (from pyramid top to bottom)
     for pyramid_level in range(config['pyramid_size']):
         new_shape = get_new_shape(config, original_shape, pyramid_level)
-        img = cv.resize(img, (new_shape[1], new_shape[0]))  # resize depending on the current pyramid level
-        input_tensor = pytorch_input_adapter(img)  # convert to trainable tensor
+        new_shape = (int(new_shape[0]), int(new_shape[1]))
+        if tuple(input_tensor.shape[2:]) != new_shape:  # resize depending on the current pyramid level
+            # same as for loading images, area interpolation when shrinking and bicubic when enlarging
+            if new_shape[1] < input_tensor.shape[3]:
+                input_tensor = F.interpolate(input_tensor.detach(), size=new_shape, mode='area')
+            else:
+                input_tensor = F.interpolate(input_tensor.detach(), size=new_shape, mode='bicubic', align_corners=False)
+            input_tensor.requires_grad_(True)
 
         for iteration in range(config['num_gradient_ascent_iterations']):
             
@@ -461,24 +489,24 @@ def deep_dream_static_image(config, img=None):
             #print("input_tensor 0 min ", torch.min(input_tensor), " max ", torch.max(input_tensor))
             
             # Introduce some randomness, it will give us more diverse results especially when you're making videos
-            h_shift, w_shift = np.random.randint(-config['spatial_shift_size'], config['spatial_shift_size'] + 1, 2)
-            input_tensor = random_circular_spatial_shift(input_tensor, h_shift, w_shift)
+            if spatial_shift_size != 0:
+                h_shift, w_shift = int(shifts[pyramid_level, iteration, 0]), int(shifts[pyramid_level, iteration, 1])
+                input_tensor = random_circular_spatial_shift(input_tensor, h_shift, w_shift)
             
             #print("input_tensor 1 min ", torch.min(input_tensor), " max ", torch.max(input_tensor))
 
             # This is where the magic happens, treat it as a black box until the next cell
-            gradient_ascent(config, model, input_tensor, layers_to_use, features_to_use, iteration)
+            gradient_ascent(config, model, input_tensor, feature_slices, smoothers[iteration])
             
             #print("input_tensor 2 min ", torch.min(input_tensor), " max ", torch.max(input_tensor))
 
             # Roll back by the same amount as above (hence should_undo=True)
-            input_tensor = random_circular_spatial_shift(input_tensor, h_shift, w_shift, should_undo=True)
+            if spatial_shift_size != 0:
+                input_tensor = random_circular_spatial_shift(input_tensor, h_shift, w_shift, should_undo=True)
             
             #print("input_tensor 3 min ", torch.min(input_tensor), " max ", torch.max(input_tensor))
 
-        img = pytorch_output_adapter(input_tensor)
-
-    return post_process_numpy_img(img)
+    return pytorch_output_adapter(input_tensor)
 
 """
 And finally this is where the magic happens!
@@ -488,34 +516,36 @@ LOWER_IMAGE_BOUND = torch.tensor((-IMAGENET_MEAN_1 / IMAGENET_STD_1).reshape(1,
 UPPER_IMAGE_BOUND = torch.tensor(((1 - IMAGENET_MEAN_1) / IMAGENET_STD_1).reshape(1, -1, 1, 1)).to(DEVICE)
 
 
-def gradient_ascent(config, model, input_tensor, layers_to_use, features_to_use, iteration):
+def gradient_ascent(config, model, input_tensor, feature_slices, smoother):
     
     #print("gradient_ascent")
     #print("input_tensor 0 min ", torch.min(input_tensor), " max ", torch.max(input_tensor))
     
-    # Step 0: Feed forward pass
-    _, out = model(input_tensor)
+    # Step 0: Feed forward pass (the gradient flows back through the cast into the float32 image)
+    _, out = model(input_tensor.to(MODEL_DTYPE))
 
     # Step 1: Grab activations/feature maps of interest
-    
-    #print("layers_to_use ", layers_to_use)
-    
-    activations = [out[layer_to_use][:, feature_to_use:feature_to_use+1, :] for layer_to_use, feature_to_use in zip(layers_to_use, features_to_use)]
+
+    #print("feature_slices ", feature_slices)
+
+    activations = []
+    for layer_to_use, feature_to_use in feature_slices:
+        if isinstance(feature_to_use, tuple):  # a different feature for every image, shape = (N, H, W) -> (N, 1, H, W)
+            activations.append(out[layer_to_use][feature_to_use].unsqueeze(1))
+        else:
+            activations.append(out[layer_to_use].narrow(1, feature_to_use, 1))
 
     # Step 2: Calculate loss over activations
-    losses = []
-    for layer_activation in activations:
-        
-        #print("activation min ", torch.min(layer_activation), " max ", torch.max(layer_activation))
-        
-        # Use torch.norm(torch.flatten(layer_activation), p) with p=2 for L2 loss and p=1 for L1 loss. 
-        # But I'll use the MSE as it works really good, I didn't notice any serious change when going to L1/L2.
-        # using torch.zeros_like as if we wanted to make activations as small as possible but we'll do gradient ascent
-        # and that will cause it to actually amplify whatever the network "sees" thus yielding the famous DeepDream look
-        loss_component = torch.nn.MSELoss(reduction='mean')(layer_activation, torch.zeros_like(layer_activation))
-        losses.append(loss_component)
-
-    loss = torch.mean(torch.stack(losses))
+    # Use torch.norm(torch.flatten(layer_activation), p) with p=2 for L2 loss and p=1 for L1 loss.
+    # But I'll use the MSE as it works really good, I didn't notice any serious change when going to L1/L2.
+    # MSE against zeros as if we wanted to make activations as small as possible but we'll do gradient ascent
+    # and that will cause it to actually amplify whatever the network "sees" thus yielding the famous DeepDream look
+    # (computed directly as the mean of squares, so no zeros tensor needs to be allocated)
+    # (per image and summed over the batch, so the images in a batch don't influence each other)
+    losses = [layer_activation.float().pow(2).mean(dim=(1, 2, 3)) for layer_activation in activations]
+
+    loss = torch.mean(torch.stack(losses), dim=0).sum()
+
     loss.backward()
 
     # Step 3: Process image gradients (smoothing + normalization, more an art then a science)
@@ -525,35 +555,35 @@ def gradient_ascent(config, model, input_tensor, layers_to_use, features_to_use,
 
     # Applies 3 Gaussian kernels and thus "blurs" or smoothens the gradients and gives visually more pleasing results
     # We'll see the details of this one in the next cell and that's all, you now understand DeepDream!
-    sigma = ((iteration + 1) / config['num_gradient_ascent_iterations']) * 2.0 + config['smoothing_coefficient']
-    smooth_grad = CascadeGaussianSmoothing(kernel_size=9, sigma=sigma)(grad)  # "magic number" 9 just works well
+    smooth_grad = smoother(grad)
 
     # Normalize the gradients (make them have mean = 0 and std = 1)
     # I didn't notice any big difference normalizing the mean as well - feel free to experiment
-    g_std = torch.std(smooth_grad)
-    g_mean = torch.mean(smooth_grad)
-    smooth_grad = smooth_grad - g_mean
-    
-    if torch.is_nonzero(g_std):
-        smooth_grad = smooth_grad / g_std
+    # var_mean computes both moments in a single pass, and clamping the std instead of checking it for zero
+    # avoids a GPU -> CPU sync (a zero std means a constant gradient, which is all zeros after subtracting the mean anyway)
+    g_var, g_mean = torch.var_mean(smooth_grad, dim=(1, 2, 3), keepdim=True)  # per image of the batch
+    g_std = g_var.sqrt()
+    smooth_grad.sub_(g_mean)  # smooth_grad is a fresh output of the smoother, so it can be normalized in place
+    smooth_grad.div_(g_std.clamp_min(1e-8))
     
     #print("g_std min ", torch.min(g_std), " max ", torch.max(g_std))
     #print("g_mean min ", torch.min(g_mean), " max ", torch.max(g_mean))
     #print("smooth_grad min ", torch.min(smooth_grad), " max ", torch.max(smooth_grad))
 
     # Step 4: Update image using the calculated gradients (gradient ascent step)
-    input_tensor.data += config['lr'] * smooth_grad
+    input_tensor.data.add_(smooth_grad, alpha=config['lr'])
     
     #print("input_tensor 1 min ", torch.min(input_tensor), " max ", torch.max(input_tensor))
 
     # Step 5: Clear gradients and clamp the data (otherwise values would explode to +- "infinity")
     input_tensor.grad.data.zero_()
-    input_tensor.data = torch.max(torch.min(input_tensor, UPPER_IMAGE_BOUND), LOWER_IMAGE_BOUND)
+    input_tensor.data.clamp_(min=LOWER_IMAGE_BOUND, max=UPPER_IMAGE_BOUND)
     
 """
 Finally let us see how the gradient smoothing via the Gaussian is implemented:
     
 What it does is it creates three 9x9 Gaussian kernels and it applies them, depthwise, over the input gradients.
+(each of them as a 1x9 followed by a 9x1 kernel, which is the same thing for a Gaussian but a lot cheaper)
 
 Kernel 1 is applied to channels 1, 2 and 3 and it preserves the shape i.e. we go from (1, 3, H, W) to (1, 3, H, W).
 Similarly for kernels 2 and 3 and then we just combine the output by taking a mean.
@@ -578,34 +608,31 @@ class CascadeGaussianSmoothing(nn.Module):
         sigmas = [[coeff * sigma, coeff * sigma] for coeff in cascade_coefficients]  # isotropic Gaussian
 
         self.pad = int(kernel_size[0] / 2)  # assure we have the same spatial resolution
+        self.reflection_pad = nn.ReflectionPad2d(self.pad)
 
-        # The gaussian kernel is the product of the gaussian function of each dimension.
-        kernels = []
-        meshgrids = torch.meshgrid([torch.arange(size, dtype=torch.float32) for size in kernel_size])
+        # The gaussian kernel is the product of the gaussian function of each dimension, i.e. it's separable.
+        # So instead of a dense KxK kernel we apply a Kx1 and a 1xK kernel (2K instead of K^2 multiply-adds per pixel)
+        row_kernels = []
+        column_kernels = []
         for sigma in sigmas:
-            kernel = torch.ones_like(meshgrids[0])
-            for size_1d, std_1d, grid in zip(kernel_size, sigma, meshgrids):
+            kernels_1d = []
+            for size_1d, std_1d in zip(kernel_size, sigma):
+                grid = torch.arange(size_1d, dtype=torch.float32)
                 mean = (size_1d - 1) / 2
-                kernel *= 1 / (std_1d * math.sqrt(2 * math.pi)) * torch.exp(-((grid - mean) / std_1d) ** 2 / 2)
-            kernels.append(kernel)
-
-        gaussian_kernels = []
-        for kernel in kernels:
-            # Normalize - make sure sum of values in gaussian kernel equals 1.
-            kernel = kernel / torch.sum(kernel)
-            # Reshape to depthwise convolutional weight
-            kernel = kernel.view(1, 1, *kernel.shape)
-            kernel = kernel.repeat(3, 1, 1, 1)
-            kernel = kernel.to(DEVICE)
+                kernel = 1 / (std_1d * math.sqrt(2 * math.pi)) * torch.exp(-((grid - mean) / std_1d) ** 2 / 2)
+                # Normalize - make sure sum of values in gaussian kernel equals 1 (then so does their product)
+                kernels_1d.append(kernel / torch.sum(kernel))
             
-            #print("CascadeGaussianSmoothing kernel s ", kernel.shape)
+            #print("CascadeGaussianSmoothing kernel s ", kernels_1d[0].shape, kernels_1d[1].shape)
 
-            gaussian_kernels.append(kernel)
+            # Reshape to depthwise convolutional weights
+            column_kernels.append(kernels_1d[0].view(1, 1, -1, 1))
+            row_kernels.append(kernels_1d[1].view(1, 1, 1, -1))
 
-        self.weight1 = gaussian_kernels[0]
-        self.weight2 = gaussian_kernels[1]
-        self.weight3 = gaussian_kernels[2]
-        self.conv = F.conv2d
+        # Stack the 3 kernels into single depthwise weights of shape (9, 1, 1, K) and (9, 1, K, 1)
+        # output channels 3*c .. 3*c+2 all belong to input channel c, hence kernels vary fastest
+        self.register_buffer('row_weight', torch.cat(row_kernels, dim=0).repeat(3, 1, 1, 1).to(DEVICE))
+        self.register_buffer('column_weight', torch.cat(column_kernels, dim=0).repeat(3, 1, 1, 1).to(DEVICE))
 
     def forward(self, input):
         
@@ -613,23 +640,32 @@ class CascadeGaussianSmoothing(nn.Module):
         
         #print("pad ", self.pad)
         
-        input = F.pad(input, [self.pad, self.pad, self.pad, self.pad], mode='reflect')
+        input = self.reflection_pad(input)
         
         #print("input2 s ", input.shape)
 
-        # Apply Gaussian kernels depthwise over the input (hence groups equals the number of input channels)
-        # shape = (1, 3, H, W) -> (1, 3, H, W)
+        # Apply all 3 Gaussian row kernels depthwise over the input in a single conv (hence groups equals the number of input channels)
+        # and then each of the 9 resulting channels with its matching column kernel
+        # shape = (N, 3, H + 2P, W + 2P) -> (N, 9, H + 2P, W) -> (N, 9, H, W) -> (N, 3, 3, H, W) and the mean over the kernels gives (N, 3, H, W)
         num_in_channels = input.shape[1]
-        grad1 = self.conv(input, weight=self.weight1, groups=num_in_channels)
-        grad2 = self.conv(input, weight=self.weight2, groups=num_in_channels)
-        grad3 = self.conv(input, weight=self.weight3, groups=num_in_channels)
-        
-        grad_total = (grad1 + grad2 + grad3) / 3
-        
-        #print("grad_total s ", grad_total.shape)
+        grad = F.conv2d(input, weight=self.row_weight, groups=num_in_channels)
+        grad = F.conv2d(grad, weight=self.column_weight, groups=grad.shape[1])
+        grad = grad.view(grad.shape[0], num_in_channels, 3, grad.shape[2], grad.shape[3])
         
+        #print("grad s ", grad.shape)
 
-        return (grad1 + grad2 + grad3) / 3
+        return grad.mean(dim=2)
+
+# scripted smoothers by sigma, so that runs with the same settings share their kernels
+GRADIENT_SMOOTHERS = {}
+
+# The smoothing gets stronger as the gradient ascent iterations progress
+def build_gradient_smoother(config, iteration):
+    sigma = ((iteration + 1) / config['num_gradient_ascent_iterations']) * 2.0 + config['smoothing_coefficient']
+    if sigma not in GRADIENT_SMOOTHERS:
+        smoother = CascadeGaussianSmoothing(kernel_size=9, sigma=sigma)  # "magic number" 9 just works well
+        GRADIENT_SMOOTHERS[sigma] = torch.jit.script(smoother)
+    return GRADIENT_SMOOTHERS[sigma]
 
 """
 Input arguments and run the damn thing
@@ -687,11 +723,11 @@ print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
 Iterate through all layers and feature maps
 """
 
-model = fetch_and_prepare_model(config['model_name'], config['pretrained_weights'])
+model = fetch_and_compile_model(config['model_name'], config['pretrained_weights'])
 
 # test model
 
-model_test_input = torch.zeros((1, 3, 128, 128)).to(device)
+model_test_input = torch.zeros((1, 3, 128, 128)).to(DEVICE, MODEL_DTYPE)
 model_test_output, model_layer_outputs = model(model_test_input)
 
 print("model_test_input s ", model_test_input.shape)
@@ -736,19 +772,30 @@ print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
 Iterate through all layers and feature maps
 """
 
+# The features of a layer are dreamed in parallel, as a batch of copies of the input image where each copy maximizes another feature
+config["batch_size"] = 8
+
+# same start image as deep_dream_static_image (respects config['use_noise'])
+img = load_input_image(config)
+
 for layer_index, feature_count in enumerate(feature_counts):
-    for feature_index in range(feature_count):
+    for first_feature_index in range(0, feature_count, config["batch_size"]):
+        
+        feature_indices = list(range(first_feature_index, min(first_feature_index + config["batch_size"], feature_count)))
         
         config["layers_to_use"] =  [ layer_names[layer_index] ]
-        config["features_to_use"] =  [feature_index]
+        config["features_to_use"] =  [feature_indices]
         
-        print("perform deep dream with layer ", config["layers_to_use"], " feature ", config["features_to_use"] )
+        print("perform deep dream with layer ", config["layers_to_use"], " features ", feature_indices )
         
-        img = deep_dream_static_image(config) 
+        imgs = deep_dream_static_batch(config, [img] * len(feature_indices))
         
-        config['should_display'] = False
-        dump_path = save_and_maybe_display_image(config, img)
-        #print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
+        for feature_index, img_dream in zip(feature_indices, imgs):
+            
+            config["features_to_use"] =  [feature_index]
+            config['should_display'] = False
+            dump_path = save_and_maybe_display_image(config, img_dream)
+            #print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
         
 """
 iterate through sequence of images and apply same deep dreap settings to each image
@@ -781,21 +828,110 @@ dump_path = save_and_maybe_display_image(config, img)
 #print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
 """
 
-for root, _, fnames in sorted(os.walk(images_file_path, followlinks=True)):
-    
-    for fname in fnames:
-    
-        print("fname ", fname)
+# images are dreamed in batches of this size, only images with the same shape can go into the same batch
+config["batch_size"] = 8
+
+# the settings are the same for the whole sequence, so the layer validation and smoothing kernels are done once
+runner = make_runner(config)
+if runner is None:  # make_runner already printed the invalid and the available layer names
+    sys.exit(1)
+
+# Loading, dreaming and saving run in a pipeline: a loader thread reads and resizes the next images and a writer thread
+# encodes and saves the dreamed ones, while the main thread keeps the GPU busy. The bounded queues limit how far ahead they get.
+# Errors in the threads are passed to the main thread, which raises them: a loader error as soon as it is taken from the
+# queue, a writer error before the next batch is dreamed (or at the end). The end of sequence markers are always sent,
+# so no thread is left waiting on a queue forever.
+
+def load_images(img_paths, load_queue):
+    try:
+        for img_path in img_paths:
+            img = load_image(img_path, target_shape=config['img_width'])
+            load_queue.put((img_path, img))
+    except Exception as e:
+        load_queue.put(e)  # raised by the main thread
+    finally:
+        load_queue.put(None)  # end of sequence
+
+def save_images(config, save_queue, save_errors):
+    while True:
+        item = save_queue.get()
+        if item is None:  # end of sequence
+            break
         
-        config["input"] = images_file_path + "/" + fname
+        # after an error the remaining images are only taken from the queue, so that the main thread doesn't block on it
+        if len(save_errors) > 0:
+            continue
         
-        img = deep_dream_static_image(config)  # yep a single liner
+        img_path, img = item
         
         #print("img min ", np.min(img), " max ", np.max(img))
+        
+        try:
+            config["input"] = img_path
+            config['should_display'] = False
+            dump_path = save_and_maybe_display_image(config, img)
+            #print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
+        except Exception as e:
+            save_errors.append(e)  # raised by the main thread
+
+def dream_and_save_batch(img_paths, imgs, save_queue):
+    dreamed_imgs = runner(imgs)
     
-        config['should_display'] = False
-        dump_path = save_and_maybe_display_image(config, img)
-        #print(f'Saved DeepDream static image to: {os.path.relpath(dump_path)}\n')
+    for img_path, img in zip(img_paths, dreamed_imgs):
+        save_queue.put((img_path, img))
+
+# the sequence is a flat folder of images, sorted by name so that the frames are processed in order
+img_paths = [entry.path for entry in sorted((entry for entry in os.scandir(images_file_path) if entry.is_file()), key=lambda entry: entry.name)]
+
+load_queue = queue.Queue(maxsize=2 * config["batch_size"])
+save_queue = queue.Queue(maxsize=2 * config["batch_size"])
+
+save_errors = []
+
+# daemon threads, a loader that is blocked on a full queue after an error doesn't keep the process alive
+loader = threading.Thread(target=load_images, args=(img_paths, load_queue), daemon=True)
+writer = threading.Thread(target=save_images, args=(dict(config), save_queue, save_errors), daemon=True)  # the writer gets its own config to set the image names
+loader.start()
+writer.start()
+
+batch_img_paths = []
+batch_imgs = []
+
+try:
+    while True:
+        item = load_queue.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):  # the loader failed
+            raise item
+        
+        img_path, img = item
+        
+        print("fname ", os.path.basename(img_path))
+        
+        if len(batch_imgs) > 0 and (len(batch_imgs) == config["batch_size"] or img.shape != batch_imgs[0].shape):
+            if len(save_errors) > 0:  # the writer failed, don't dream images that can't be saved
+                raise save_errors[0]
+            dream_and_save_batch(batch_img_paths, batch_imgs, save_queue)
+            batch_img_paths = []
+            batch_imgs = []
+        
+        batch_img_paths.append(img_path)
+        batch_imgs.append(img)
+        
+    if len(batch_imgs) > 0:
+        if len(save_errors) > 0:
+            raise save_errors[0]
+        dream_and_save_batch(batch_img_paths, batch_imgs, save_queue)
+finally:
+    # the writer always gets the end of sequence marker and saves the images that were dreamed so far
+    save_queue.put(None)
+    writer.join()
+
+loader.join()
+
+if len(save_errors) > 0:  # the writer failed
+    raise save_errors[0]
 
     
     #for fname in sorted(fnames):
\ No newline at end of file
@@ -0,0 +1,155 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+
+"""
+compiled versions of the batched quaternion functions and of the transform update in skeleton.py for float32 arrays
+the loops run without the GIL, so the OSC threads and the render thread don't block each other
+"""
+
+import numpy as np
+from libc.math cimport sqrt
+
+def qmult_batch(q1, q2):
+    """
+    Hamilton product of quaternions
+    :param q1: shape = (N, 4) or (1, 4)
+    :param q2: shape = (N, 4) or (1, 4)
+    :return: res: shape = (N, 4)
+    """
+    cdef float[:, ::1] a = np.ascontiguousarray(q1, dtype=np.float32)
+    cdef float[:, ::1] b = np.ascontiguousarray(q2, dtype=np.float32)
+    cdef Py_ssize_t n = max(a.shape[0], b.shape[0])
+
+    res = np.empty((n, 4), dtype=np.float32)
+    cdef float[:, ::1] out = res
+
+    cdef Py_ssize_t i, ia, ib
+    cdef Py_ssize_t sa = 0 if a.shape[0] == 1 else 1
+    cdef Py_ssize_t sb = 0 if b.shape[0] == 1 else 1
+    cdef float w1, x1, y1, z1, w2, x2, y2, z2
+
+    with nogil:
+        for i in range(n):
+            ia = i * sa
+            ib = i * sb
+            w1 = a[ia, 0]; x1 = a[ia, 1]; y1 = a[ia, 2]; z1 = a[ia, 3]
+            w2 = b[ib, 0]; x2 = b[ib, 1]; y2 = b[ib, 2]; z2 = b[ib, 3]
+
+            out[i, 0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+            out[i, 1] = w1*x2 + x1*w2 + y1*z2 - z1*y2
+            out[i, 2] = w1*y2 + y1*w2 + z1*x2 - x1*z2
+            out[i, 3] = w1*z2 + z1*w2 + x1*y2 - y1*x2
+
+    return res
+
+def quat2mat_batch(q):
+    """
+    same as t3d.quaternions.quat2mat for an array of quaternions
+    :param q: shape = (N, 4)
+    :return: res: shape = (N, 3, 3)
+    """
+    cdef float[:, ::1] qv = np.ascontiguousarray(q, dtype=np.float32)
+    cdef Py_ssize_t n = qv.shape[0]
+
+    res = np.empty((n, 3, 3), dtype=np.float32)
+    cdef float[:, :, ::1] out = res
+
+    cdef Py_ssize_t i
+    cdef float w, x, y, z, Nq, s, X, Y, Z, wX, wY, wZ, xX, xY, xZ, yY, yZ, zZ
+    cdef float eps = np.finfo(np.float64).eps
+
+    with nogil:
+        for i in range(n):
+            w = qv[i, 0]; x = qv[i, 1]; y = qv[i, 2]; z = qv[i, 3]
+            Nq = w*w + x*x + y*y + z*z
+            s = 0.0 if Nq < eps else 2.0 / Nq  # zero quaternions become identity matrices
+            X = x*s; Y = y*s; Z = z*s
+            wX = w*X; wY = w*Y; wZ = w*Z
+            xX = x*X; xY = x*Y; xZ = x*Z
+            yY = y*Y; yZ = y*Z; zZ = z*Z
+
+            out[i, 0, 0] = 1.0 - (yY + zZ); out[i, 0, 1] = xY - wZ; out[i, 0, 2] = xZ + wY
+            out[i, 1, 0] = xY + wZ; out[i, 1, 1] = 1.0 - (xX + zZ); out[i, 1, 2] = yZ - wX
+            out[i, 2, 0] = xZ - wY; out[i, 2, 1] = yZ + wX; out[i, 2, 2] = 1.0 - (xX + yY)
+
+    return res
+
+cdef inline void quat_mult(float w1, float x1, float y1, float z1, float w2, float x2, float y2, float z2, float* out) noexcept nogil:
+    out[0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    out[1] = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    out[2] = w1*y2 + y1*w2 + z1*x2 - x1*z2
+    out[3] = w1*z2 + z1*w2 + x1*y2 - y1*x2
+
+cdef inline void quat_to_mat(float* q, float* m) noexcept nogil:
+    cdef float w = q[0], x = q[1], y = q[2], z = q[3]
+    cdef float Nq = w*w + x*x + y*y + z*z
+    cdef float s = 0.0 if Nq < 2.220446049250313e-16 else 2.0 / Nq # zero quaternions become identity matrices
+    cdef float X = x*s, Y = y*s, Z = z*s
+    cdef float wX = w*X, wY = w*Y, wZ = w*Z
+    cdef float xX = x*X, xY = x*Y, xZ = x*Z
+    cdef float yY = y*Y, yZ = y*Z, zZ = z*Z
+
+    m[0] = 1.0 - (yY + zZ); m[1] = xY - wZ; m[2] = xZ + wY
+    m[3] = xY + wZ; m[4] = 1.0 - (xX + zZ); m[5] = yZ - wX
+    m[6] = xZ - wY; m[7] = yZ + wX; m[8] = 1.0 - (xX + yY)
+
+cdef inline void compose_transform(float* q, float px, float py, float pz, float[:, ::1] skelRot, float[::1] skelPos, float[:, :, ::1] transforms, Py_ssize_t i) noexcept nogil:
+    # same as Skeleton.composeTransforms for a single row, the constant last column is not written
+    cdef float m[9]
+    cdef float p[3]
+    cdef Py_ssize_t a, b
+
+    quat_to_mat(q, m)
+
+    for a in range(3):
+        p[a] = skelRot[a, 0] * px + skelRot[a, 1] * py + skelRot[a, 2] * pz + skelPos[a]
+
+    for a in range(3):
+        for b in range(3):
+            transforms[i, a, b] = m[b*3 + 0] * skelRot[0, a] + m[b*3 + 1] * skelRot[1, a] + m[b*3 + 2] * skelRot[2, a]
+        transforms[i, 3, a] = m[a*3 + 0] * p[0] + m[a*3 + 1] * p[1] + m[a*3 + 2] * p[2]
+
+def update_transforms(jointPositions, jointRotations, jointPreRotation, edgePreRotations, edgeParents, edgeChildren, skelRotation, skelPosition, jointTransforms, edgeTransforms, edgeLengths):
+    """
+    same as Skeleton.updateJointTransforms and Skeleton.updateEdgeTransforms in a single call
+    :param jointPositions: shape = (J, 3)
+    :param jointRotations: shape = (J, 4)
+    :param jointPreRotation: shape = (1, 4)
+    :param edgePreRotations: shape = (E, 4)
+    :param edgeParents: shape = (E), int64
+    :param edgeChildren: shape = (E), int64
+    :param skelRotation: shape = (3, 3)
+    :param skelPosition: shape = (3)
+    :param jointTransforms: shape = (J, 4, 4), output
+    :param edgeTransforms: shape = (E, 4, 4), output
+    :param edgeLengths: shape = (E), output
+    """
+    cdef float[:, ::1] pos = jointPositions
+    cdef float[:, ::1] rot = jointRotations
+    cdef float[:, ::1] jointPre = jointPreRotation
+    cdef float[:, ::1] edgePre = edgePreRotations
+    cdef long long[::1] parents = edgeParents
+    cdef long long[::1] children = edgeChildren
+    cdef float[:, ::1] skelRot = skelRotation
+    cdef float[::1] skelPos = skelPosition
+    cdef float[:, :, ::1] jointOut = jointTransforms
+    cdef float[:, :, ::1] edgeOut = edgeTransforms
+    cdef float[::1] lengthOut = edgeLengths
+
+    cdef Py_ssize_t i, p, c
+    cdef float q[4]
+    cdef float dx, dy, dz
+
+    with nogil:
+        for i in range(pos.shape[0]):
+            quat_mult(jointPre[0, 0], jointPre[0, 1], jointPre[0, 2], jointPre[0, 3], rot[i, 0], rot[i, 1], rot[i, 2], rot[i, 3], q)
+            compose_transform(q, pos[i, 0], pos[i, 1], pos[i, 2], skelRot, skelPos, jointOut, i)
+
+        for i in range(parents.shape[0]):
+            p = parents[i]
+            c = children[i]
+
+            dx = pos[c, 0] - pos[p, 0]; dy = pos[c, 1] - pos[p, 1]; dz = pos[c, 2] - pos[p, 2]
+            lengthOut[i] = sqrt(dx*dx + dy*dy + dz*dz)
+
+            quat_mult(edgePre[i, 0], edgePre[i, 1], edgePre[i, 2], edgePre[i, 3], rot[p, 0], rot[p, 1], rot[p, 2], rot[p, 3], q)
+            compose_transform(q, (pos[p, 0] + pos[c, 0]) / 2, (pos[p, 1] + pos[c, 1]) / 2, (pos[p, 2] + pos[c, 2]) / 2, skelRot, skelPos, edgeOut, i)
@@ -77,32 +77,35 @@ GUI
 
 class MinimalGLWidget(QOpenGLWindow):
     
+    # emitted from the OSC threads, the queued connection schedules the repaint on the GUI thread
+    redrawRequested = QtCore.pyqtSignal()
+    
     def __init__(self, visualization):
         self.visualization = visualization
         
         super().__init__()
+        
+        # there is no animation in the shader, so a frame is only rendered when OSC changed something
+        # update() also merges several requests into one repaint
+        self.redrawRequested.connect(self.update, QtCore.Qt.QueuedConnection)
  
     
     def initializeGL(self):
         
         self.visualization.setupShader(gl)
-
-        self.renderTimer = QtCore.QTimer(self)
-        self.renderTimer.setInterval(10)
-        self.renderTimer.timeout.connect(self.onRenderTimer)
-        self.renderTimer.start()
         
         #self.showFullScreen()
         
-    def onRenderTimer(self):
+    def paintGL(self):
+        
+        skeleton.refresh()
     
         visualization.render(gl)
-        
-        self.update()
 
 if __name__ == '__main__':
     app = QApplication([])
     widget = MinimalGLWidget(visualization)
+    oscControl.setRedrawCallback(widget.redrawRequested.emit)
     widget.show()
     
     widget.resize(window_size[0], window_size[1])
@@ -33,19 +33,27 @@ uniform float lightOcclusionRange;
 uniform float lightOcclusionResolution;
 
 // joint settings
-uniform int jointPrimitives[jointCount];
-uniform mat4 jointTransforms[jointCount];
-uniform vec3 jointSizes[jointCount];
-uniform float jointRoundings[jointCount];
-uniform float jointSmoothings[jointCount];
+// the member order and the std140 layout must match the jointBlock array in visualization.py
+layout(std140) uniform JointBlock
+{
+    mat4 jointTransforms[jointCount];
+    int jointPrimitives[jointCount];
+    vec3 jointSizes[jointCount];
+    float jointRoundings[jointCount];
+    float jointSmoothings[jointCount];
+};
 
 // edge settings
-uniform int edgePrimitives[edgeCount];
-uniform mat4 edgeTransforms[edgeCount];
-uniform float edgeLengths[edgeCount];
-uniform vec3 edgeSizes[edgeCount];
-uniform float edgeRoundings[edgeCount];
-uniform float edgeSmoothings[edgeCount];
+// the member order and the std140 layout must match the edgeBlock array in visualization.py
+layout(std140) uniform EdgeBlock
+{
+    mat4 edgeTransforms[edgeCount];
+    float edgeLengths[edgeCount];
+    int edgePrimitives[edgeCount];
+    vec3 edgeSizes[edgeCount];
+    float edgeRoundings[edgeCount];
+    float edgeSmoothings[edgeCount];
+};
 
 uniform float jointEdgeSmoothing;
 
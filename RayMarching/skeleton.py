@@ -1,13 +1,45 @@
+import math
+import threading
+import logging
 import numpy as np
-import transforms3d as t3d
 
-def slerp(q0, q1, t=0.5, unit=True):
+logger = logging.getLogger(__name__)
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# the Cython quaternion module is compiled on the first import, this needs Cython and a C compiler
+try:
+    import pyximport
+except ImportError:
+    pyximport = None
+
+quatmath = None
+if pyximport is not None:
+    py_importer, pyx_importer = pyximport.install(setup_args={"include_dirs": np.get_include()}, language_level=3)
+    try:
+        import quatmath
+    except ImportError as e:
+        logger.warning("Cython module quatmath not available: %s", e)
+    finally:
+        # pyximport hooks into the import system of the whole process, only this import should go through it
+        pyximport.uninstall(py_importer, pyx_importer)
+
+# constant rotations of the joint and edge shapes, same as t3d.euler.euler2quat with axes='sxyz'
+_Q_Z_HALF_PI = np.array([np.cos(np.pi / 4.0), 0.0, 0.0, np.sin(np.pi / 4.0)], dtype=np.float32) # euler2quat(0.0, 0.0, np.pi / 2.0)
+_Q_Y_HALF_PI = np.array([np.cos(np.pi / 4.0), 0.0, np.sin(np.pi / 4.0), 0.0], dtype=np.float32) # euler2quat(0.0, np.pi / 2.0, 0.0)
+_Q_Z_NEG_HALF_PI = np.array([np.cos(np.pi / 4.0), 0.0, 0.0, -np.sin(np.pi / 4.0)], dtype=np.float32) # euler2quat(0.0, 0.0, -np.pi / 2.0)
+
+def slerp(q0, q1, t=0.5, unit=True, out=None):
     """
     tested
     :param q0: shape = (*, n)
     :param q1: shape = (*, n)
     :param t: shape = (*)
     :param unit: If q0 and q1 are unit vectors
+    :param out: shape = (*, n), optional array for the result, must not be q0 or q1
     :return: res: shape = (*, n)
     """
     eps = 1e-8
@@ -17,198 +49,387 @@ def slerp(q0, q1, t=0.5, unit=True):
     else:
         q0_n = q0
         q1_n = q1
-    omega = np.arccos((q0_n * q1_n).sum(axis=-1).clip(-1, 1))
+    dot = np.einsum('...i,...i->...', q0_n, q1_n)
+    omega = np.arccos(np.clip(dot, -1, 1))
     dom = np.sin(omega)
 
+    # linear interpolation where the quaternions are (almost) the same, without splitting the arrays by a mask
     flag = dom < eps
+    safeDom = np.maximum(dom, eps)
+    va = np.where(flag, 1 - t, np.sin((1 - t) * omega) / safeDom)
+    vb = np.where(flag, t, np.sin(t * omega) / safeDom)
+    
+    res = np.multiply(np.expand_dims(va, axis=-1), q0_n, out=out)
+    res += np.expand_dims(vb, axis=-1) * q1_n
+    return res
 
-    res = np.empty_like(q0_n)
-    t_t = np.expand_dims(t[flag], axis=-1)
-    res[flag] = (1 - t_t) * q0_n[flag] + t_t * q1_n[flag]
+if numba is not None:
+    
+    @numba.njit(fastmath=True, cache=True)
+    def slerp_nb(q0, q1, t, out):
+        """
+        same as slerp for unit vectors, but a single loop over the rows without numpy temporaries
+        :param q0: shape = (N, n)
+        :param q1: shape = (N, n)
+        :param t: shape = (N)
+        :param out: shape = (N, n), can be q0 or q1
+        :return: out
+        """
+        eps = 1e-8
+        for i in range(q0.shape[0]):
+            
+            dot = 0.0
+            for k in range(q0.shape[1]):
+                dot += q0[i, k] * q1[i, k]
+            omega = math.acos(min(max(dot, -1.0), 1.0))
+            dom = math.sin(omega)
+            
+            if dom < eps:
+                va = 1.0 - t[i]
+                vb = t[i]
+            else:
+                va = math.sin((1.0 - t[i]) * omega) / dom
+                vb = math.sin(t[i] * omega) / dom
+                
+            for k in range(q0.shape[1]):
+                out[i, k] = va * q0[i, k] + vb * q1[i, k]
+        return out
+    
+    @numba.njit(fastmath=True, cache=True)
+    def qmult_batch_nb(q1, q2, out):
+        """
+        same as qmult_batch, but a single loop over the rows without numpy temporaries
+        :param q1: shape = (N, 4) or (1, 4)
+        :param q2: shape = (N, 4) or (1, 4)
+        :param out: shape = (N, 4), must not be q1 or q2
+        :return: out
+        """
+        sa = 0 if q1.shape[0] == 1 else 1
+        sb = 0 if q2.shape[0] == 1 else 1
+        for i in range(out.shape[0]):
+            w1 = q1[i * sa, 0]; x1 = q1[i * sa, 1]; y1 = q1[i * sa, 2]; z1 = q1[i * sa, 3]
+            w2 = q2[i * sb, 0]; x2 = q2[i * sb, 1]; y2 = q2[i * sb, 2]; z2 = q2[i * sb, 3]
+            
+            out[i, 0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+            out[i, 1] = w1*x2 + x1*w2 + y1*z2 - z1*y2
+            out[i, 2] = w1*y2 + y1*w2 + z1*x2 - x1*z2
+            out[i, 3] = w1*z2 + z1*w2 + x1*y2 - y1*x2
+        return out
+    
+    @numba.njit(fastmath=True, cache=True)
+    def quat2mat_batch_nb(q, out):
+        """
+        same as quat2mat_batch, but a single loop over the rows without numpy temporaries
+        :param q: shape = (N, 4)
+        :param out: shape = (N, 3, 3)
+        :return: out
+        """
+        eps = 2.220446049250313e-16 # np.finfo(np.float64).eps
+        for i in range(q.shape[0]):
+            w = q[i, 0]; x = q[i, 1]; y = q[i, 2]; z = q[i, 3]
+            Nq = w*w + x*x + y*y + z*z
+            s = 0.0 if Nq < eps else 2.0 / Nq # zero quaternions become identity matrices
+            X = x*s; Y = y*s; Z = z*s
+            wX = w*X; wY = w*Y; wZ = w*Z
+            xX = x*X; xY = x*Y; xZ = x*Z
+            yY = y*Y; yZ = y*Z; zZ = z*Z
+            
+            out[i, 0, 0] = 1.0 - (yY + zZ); out[i, 0, 1] = xY - wZ; out[i, 0, 2] = xZ + wY
+            out[i, 1, 0] = xY + wZ; out[i, 1, 1] = 1.0 - (xX + zZ); out[i, 1, 2] = yZ - wX
+            out[i, 2, 0] = xZ - wY; out[i, 2, 1] = yZ + wX; out[i, 2, 2] = 1.0 - (xX + yY)
+        return out
 
-    flag = ~ flag
+def qmult_batch(q1, q2):
+    """
+    Hamilton product of quaternions, broadcasts like numpy arithmetic
+    :param q1: shape = (*, 4)
+    :param q2: shape = (*, 4)
+    :return: res: shape = (*, 4)
+    """
+    w1, xyz1 = q1[..., :1], q1[..., 1:]
+    w2, xyz2 = q2[..., :1], q2[..., 1:]
+    
+    w = w1 * w2 - (xyz1 * xyz2).sum(axis=-1, keepdims=True)
+    xyz = w1 * xyz2 + w2 * xyz1 + np.cross(xyz1, xyz2)
+    
+    return np.concatenate((w, xyz), axis=-1)
 
-    t_t = t[flag]
-    d_t = dom[flag]
-    va = np.sin((1 - t_t) * omega[flag]) / d_t
-    vb = np.sin(t_t * omega[flag]) / d_t
-    res[flag] = (np.expand_dims(va, axis=-1) * q0_n[flag] + np.expand_dims(vb, axis=-1) * q1_n[flag])
+def quat2mat_batch(q):
+    """
+    same as t3d.quaternions.quat2mat for an array of quaternions
+    :param q: shape = (*, 4)
+    :return: res: shape = (*, 3, 3)
+    """
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    Nq = w*w + x*x + y*y + z*z
+    s = np.where(Nq < np.finfo(np.float64).eps, 0.0, 2.0 / np.where(Nq == 0.0, 1.0, Nq)) # zero quaternions become identity matrices
+    X = x*s; Y = y*s; Z = z*s
+    wX = w*X; wY = w*Y; wZ = w*Z
+    xX = x*X; xY = x*Y; xZ = x*Z
+    yY = y*Y; yZ = y*Z; zZ = z*Z
+    
+    res = np.empty(q.shape[:-1] + (3, 3), dtype=q.dtype)
+    res[..., 0, 0] = 1.0 - (yY + zZ); res[..., 0, 1] = xY - wZ; res[..., 0, 2] = xZ + wY
+    res[..., 1, 0] = xY + wZ; res[..., 1, 1] = 1.0 - (xX + zZ); res[..., 1, 2] = yZ - wX
+    res[..., 2, 0] = xZ - wY; res[..., 2, 1] = yZ + wX; res[..., 2, 2] = 1.0 - (xX + yY)
+    
     return res
 
+# use the compiled quaternion functions if they are available
+if quatmath is not None:
+    qmult_batch = quatmath.qmult_batch
+    quat2mat_batch = quatmath.quat2mat_batch
+
+# numba is used for the slerp and the quaternion functions with output arrays, Cython for the transform update
+logger.info("skeleton backends: Cython %s, numba %s, numpy fallback %s", quatmath is not None, numba is not None, quatmath is None and numba is None)
+
 class Skeleton():
     
     def __init__(self, jointFilter, jointConnectivity):
 
-        self.jointFilter = jointFilter
+        # index array once, indexing with a list rebuilds the index array every time
+        self.jointFilter = np.asarray(jointFilter, dtype=np.int64)
+        # a filter that keeps the first joints in their order is a slice, which needs no copy
+        self.jointFilterIsIdentity = np.array_equal(self.jointFilter, np.arange(len(self.jointFilter)))
         self.jointConnectivity = jointConnectivity
         
-        self.skelTransform = np.eye(4)
-        self.skelInvTransform = np.eye(4)
+        # skeleton transform as rotation and translation, the 4x4 matrices are only assembled for the joint and edge transforms
+        self.skelRotation = np.eye(3, dtype=np.float32)
+        self.skelPosition = np.zeros(3, dtype=np.float32)
         
         self.jointCount = len(self.jointFilter)
-        self.jointPositions = np.random.rand(self.jointCount, 3)
-        self.jointRotations = np.random.rand(self.jointCount, 4)
-        self.jointTransforms = np.zeros((self.jointCount, 4, 4))
+        
+        # prerotations of joints to align joint shapes
+        self.preRot = np.zeros((self.jointCount, 4), dtype=np.float32)
+        self.preRot[:, 0] = 1.0
+        
+        # 0  : Hips
+        # 6  : LeftShoulder, 7  : LeftArm, 8  : LeftForeArm, 9  : LeftForeArmRoll, 10  : LeftHand, 11  : LeftInHandMiddle, 12  : LeftHandMiddle2
+        # 13  : RightShoulder, 14  : RightArm, 15  : RightForeArm, 16  : RightForeArmRoll, 17  : RightHand, 18  : RightInHandMiddle, 19  : RightHandMiddle2
+        # (only the joints the skeleton has, smaller skeletons keep the identity for the missing indices)
+        zPreRotJoints = np.array([0, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19])
+        self.preRot[zPreRotJoints[zPreRotJoints < self.jointCount], :] = _Q_Z_HALF_PI
+        # 22 : LeftFoot, 23 : LeftToeBase
+        # 26 : RightFoot, 27 : RightToeBase
+        yPreRotJoints = np.array([22, 23, 26, 27])
+        self.preRot[yPreRotJoints[yPreRotJoints < self.jointCount], :] = _Q_Y_HALF_PI
+        
+        # rotation that aligns the joint shapes, applied to all joints
+        self.jointPreRotation = _Q_Y_HALF_PI.reshape(1, 4)
         
         self.edgeCount = 0
         for jointChildren in self.jointConnectivity:
             self.edgeCount += len(jointChildren)
             
-        self.edgeTransforms = np.zeros((self.edgeCount, 4, 4))
-        self.edgeLengths = np.ones(self.edgeCount)
+        # parent and child joint of each edge, in the order of the jointConnectivity
+        self.edgeParents = np.fromiter((p for p, ch in enumerate(self.jointConnectivity) for _ in ch), dtype=np.int64, count=self.edgeCount)
+        self.edgeChildren = np.fromiter((c for ch in self.jointConnectivity for c in ch), dtype=np.int64, count=self.edgeCount)
+        
+        # rotation that aligns the edge shapes, the hip to spine edge gets an additional rotation
+        self.edgePreRot = np.tile(self.jointPreRotation, (self.edgeCount, 1))
+        hipSpineEdge = (self.edgeParents == 0) & (self.edgeChildren == 1)
+        self.edgePreRot[hipSpineEdge] = qmult_batch(self.jointPreRotation, _Q_Z_NEG_HALF_PI.reshape(1, 4))
+        
+        # double buffered skeleton state: refresh computes an update into the back buffer, which then becomes the front buffer
+        # refresh and the renderer both run on the GUI thread (paintGL), so the renderer never sees a partially written update
+        # the OSC threads don't touch the buffers, they only hand their data over through the pending arrays below
+        jointPositions = np.random.rand(self.jointCount, 3).astype(np.float32)
+        jointRotations = np.random.rand(self.jointCount, 4).astype(np.float32)
+        jointRotations /= np.linalg.norm(jointRotations, axis=-1, keepdims=True)
+        
+        self._front = self.createState(jointPositions, jointRotations)
+        self._back = self.createState(jointPositions, jointRotations)
+        
+        # latest joint positions and rotations from OSC that are not applied yet, the lock is the handoff from the OSC threads to the GUI thread
+        self._pendingLock = threading.Lock()
+        self._pendingPositions = None
+        self._pendingRotations = None
+        self._dirty = False
         
         self.udateSmoothing = 0.0
         
-        print("skel jointCount ", self.jointCount, " edgeCount ", self.edgeCount)
+        # scratch arrays of the per-frame update, so that the update doesn't allocate
+        # joints and edges use the first rows of the same arrays
+        maxCount = max(self.jointCount, self.edgeCount)
+        self._preRotBuf = np.empty((self.jointCount, 4), dtype=np.float32)
+        self._rotBuf = np.empty((maxCount, 4), dtype=np.float32)
+        self._rotMatBuf = np.empty((maxCount, 3, 3), dtype=np.float32)
+        self._skelRotMatBuf = np.empty((maxCount, 3, 3), dtype=np.float32)
+        self._posBuf = np.empty((maxCount, 3), dtype=np.float32)
+        self._edgeParentPosBuf = np.empty((self.edgeCount, 3), dtype=np.float32)
+        self._edgeChildPosBuf = np.empty((self.edgeCount, 3), dtype=np.float32)
+        self._edgePosBuf = np.empty((self.edgeCount, 3), dtype=np.float32)
+        self._edgeParentRotBuf = np.empty((self.edgeCount, 4), dtype=np.float32)
+        self._smoothingBuf = np.empty(self.jointCount, dtype=np.float32)
+        
+        logger.debug("skeleton jointCount %d edgeCount %d", self.jointCount, self.edgeCount)
+        
+    def createState(self, jointPositions, jointRotations):
+        
+        state = {}
+        state["jointPositions"] = np.copy(jointPositions)
+        state["jointRotations"] = np.copy(jointRotations)
+        state["jointTransforms"] = np.zeros((self.jointCount, 4, 4), dtype=np.float32)
+        state["jointTransforms"][:, 3, 3] = 1.0
+        state["edgeTransforms"] = np.zeros((self.edgeCount, 4, 4), dtype=np.float32)
+        state["edgeTransforms"][:, 3, 3] = 1.0
+        state["edgeLengths"] = np.ones(self.edgeCount, dtype=np.float32)
+        state["version"] = 0 # counts the updates, lets the renderer skip uploads when the skeleton didn't change
+        
+        return state
+    
+    def swapState(self):
+        
+        self._back["version"] = self._front["version"] + 1
+        
+        self._front, self._back = self._back, self._front
         
     def setUpdateSmoothing(self, updateSmoothing):
         self.udateSmoothing = updateSmoothing
         
     def setPosition(self, position):
 
-        self.skelTransform  = t3d.affines.compose(position, np.eye(3), np.ones((3)))
-        self.skelInvTransform = t3d.affines.compose(position * -1.0, np.eye(3), np.ones((3)))
+        self.skelPosition = np.asarray(position, dtype=np.float32).copy()
 
+    # the joint positions and rotations only get stored here, the skeleton is updated once per frame in refresh
+    # so that several OSC messages between two frames don't cause several updates
     def setJointPositions(self, positions):
         
-        positions = positions[self.jointFilter, :]
+        if self.jointFilterIsIdentity:
+            positions = positions[:self.jointCount].astype(np.float32, copy=False)
+        else:
+            positions = positions[self.jointFilter, :].astype(np.float32, copy=False)
         
-        if positions.shape != self.jointPositions.shape:
+        if positions.shape != (self.jointCount, 3):
             return
-
-        self.jointPositions = self.jointPositions * self.udateSmoothing + positions * (1.0 - self.udateSmoothing)
         
-        self.updateJointTransforms()
-        self.updateEdgeTransforms()
+        with self._pendingLock:
+            if self._pendingPositions is not None and np.array_equal(positions, self._pendingPositions):
+                return
+            
+            self._pendingPositions = positions
+            self._dirty = True
         
     def setJointRotations(self, rotations):
         
-        rotations = rotations[self.jointFilter, :]
+        if self.jointFilterIsIdentity:
+            rotations = rotations[:self.jointCount].astype(np.float32, copy=False)
+        else:
+            rotations = rotations[self.jointFilter, :].astype(np.float32, copy=False)
         
-        # prerotations of joints to align joint shapes
+        if rotations.shape != (self.jointCount, 4):
+            return
         
-        # 0  : Hips
-        rotations[0,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[0,:])
-        
-        # 6  : LeftShoulder
-        rotations[6,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[6,:])
-        # 7  : LeftArm
-        rotations[7,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[7,:])
-        # 8  : LeftForeArm
-        rotations[8,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[8,:])
-        # 9  : LeftForeArmRoll
-        rotations[9,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[9,:])
-        # 10  : LeftHand
-        rotations[10,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[10,:])
-        # 11  : LeftInHandMiddle
-        rotations[11,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[11,:])
-        # 12  : LeftHandMiddle2
-        rotations[12,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[12,:])
-        
-        # 13  : RightShoulder
-        rotations[13,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[13,:])
-        # 14  : RightArm
-        rotations[14,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[14,:])
-        # 15  : RightForeArm
-        rotations[15,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[15,:])
-        # 16  : RightForeArmRoll
-        rotations[16,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[16,:])
-        # 17  : RightHand
-        rotations[17,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[17,:])
-        # 18  : RightInHandMiddle
-        rotations[18,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[18,:])
-        # 19  : RightHandMiddle2
-        rotations[19,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, np.pi / 2.0, axes='sxyz'), rotations[19,:])
-        
-        # 22 : LeftFoot
-        rotations[22,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, np.pi / 2.0, 0.0, axes='sxyz'), rotations[22,:])
-        # 23 : LeftToeBase
-        rotations[23,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, np.pi / 2.0, 0.0, axes='sxyz'), rotations[23,:])
-        
-        # 26 : RightFoot
-        rotations[26,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, np.pi / 2.0, 0.0, axes='sxyz'), rotations[26,:])
-        # 27 : RightToeBase
-        rotations[27,:] = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, np.pi / 2.0, 0.0, axes='sxyz'), rotations[27,:])
-
-        if rotations.shape != self.jointRotations.shape:
+        with self._pendingLock:
+            if self._pendingRotations is not None and np.array_equal(rotations, self._pendingRotations):
+                return
+            
+            self._pendingRotations = rotations
+            self._dirty = True
+            
+    # applies the joint positions and rotations received since the last refresh, call this once before rendering a frame
+    # on the thread that renders
+    def refresh(self):
+        
+        if not self._dirty:
             return
-
-        # TODO: address problem with rotation smoothing causes quick oscillations of some joints
-        self.jointRotations = slerp(self.jointRotations, rotations, np.ones(self.jointCount) * (1.0 - self.udateSmoothing))
-        self.jointRotations = self.jointRotations / np.linalg.norm(self.jointRotations)
-
-        #self.jointRotations = rotations
         
-        self.updateJointTransforms()
-        self.updateEdgeTransforms()
+        with self._pendingLock:
+            positions, rotations = self._pendingPositions, self._pendingRotations
+            self._pendingPositions = None
+            self._pendingRotations = None
+            self._dirty = False
         
-    def updateJointTransforms(self):
+        front, back = self._front, self._back
         
-        defaultScale = np.ones((3))
-        defaultRot = np.array([1.0, 0.0, 0.0, 0.0])
-        defaultPos = np.array([0.0, 0.0, 0.0])
-        defaultRotMat = (t3d.quaternions.quat2mat(defaultRot))
-
-        for jI in range(self.jointCount):
-            
-            jointPosition = self.jointPositions[jI]
-            jointRotation = self.jointRotations[jI] # / np.linalg.norm(self.jointRotations[jI])
-            jointRotation = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, np.pi / 2.0, 0.0, axes='sxyz'), jointRotation)
-            
-            jointRotMat = t3d.quaternions.quat2mat(jointRotation)
-            jointRotMat = t3d.affines.compose(defaultPos, jointRotMat, defaultScale)
-   
-            jointTransMat = t3d.affines.compose(jointPosition, defaultRotMat, defaultScale)
-
-            self.jointTransforms[jI] = np.transpose(np.matmul(jointRotMat, np.matmul(self.skelTransform, jointTransMat)))
-
-
-    def updateEdgeTransforms(self):
-
-        defaultScale = np.ones((3))
-        defaultRot = np.array([1.0, 0.0, 0.0, 0.0])
-        defaultPos = np.array([0.0, 0.0, 0.0])
-        defaultRotMat = (t3d.quaternions.quat2mat(defaultRot))
-        refDir = np.array([0.0, 0.0, 1.0])
+        if positions is not None:
+            # front + (new - front) * (1 - smoothing), computed in the back buffer without temporaries
+            np.subtract(positions, front["jointPositions"], out=back["jointPositions"])
+            back["jointPositions"] *= 1.0 - self.udateSmoothing
+            back["jointPositions"] += front["jointPositions"]
+        else:
+            back["jointPositions"][:] = front["jointPositions"]
         
-        eI = 0
-
-        for pjI in range(self.jointCount):
+        if rotations is not None:
+            # prerotations of joints to align joint shapes, once per frame and not for every OSC message
+            if numba is not None:
+                rotations = qmult_batch_nb(self.preRot, rotations, self._preRotBuf)
+            else:
+                rotations = qmult_batch(self.preRot, rotations)
             
-            parentJointPos = self.jointPositions[pjI]
-            parentJointRot = self.jointRotations[pjI] / np.linalg.norm(self.jointRotations[pjI])
+            # TODO: address problem with rotation smoothing causes quick oscillations of some joints
+            self._smoothingBuf.fill(1.0 - self.udateSmoothing)
+            if numba is not None:
+                slerp_nb(front["jointRotations"], rotations, self._smoothingBuf, back["jointRotations"])
+            else:
+                slerp(front["jointRotations"], rotations, self._smoothingBuf, out=back["jointRotations"])
+            # per quaternion, zero quaternions from OSC stay zero instead of becoming nan
+            n = np.linalg.norm(back["jointRotations"], axis=-1, keepdims=True)
+            np.divide(back["jointRotations"], np.maximum(n, 1e-12), out=back["jointRotations"])
 
-            children = self.jointConnectivity[pjI]
-            
-            for cjI in children:
-                
-                childJointPos = self.jointPositions[cjI]
-                
-                edgePos = (parentJointPos + childJointPos) / 2
-                
-                edgeVec = childJointPos - parentJointPos
-                edgeLength = np.linalg.norm(edgeVec)
-                
-                #print("pjI ", pjI, " cjI ", cjI, " edgeVec ", edgeVec, " edgeLength ", edgeLength)
-                
-                edgeRotation = self.jointRotations[pjI] # / np.linalg.norm(self.jointRotations[pjI])
-                
-                if pjI == 0 and cjI == 1: # hip to spine edge
-                    edgeRotation = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, 0.0, -np.pi / 2.0, axes='sxyz'), edgeRotation)
-                    
-                edgeRotation = t3d.quaternions.qmult(t3d.euler.euler2quat(0.0, np.pi / 2.0, 0.0, axes='sxyz'), edgeRotation)
-                
-                edgeRotMat = t3d.quaternions.quat2mat(edgeRotation)
-                edgeRotMat = t3d.affines.compose(defaultPos, edgeRotMat, defaultScale)
+            #back["jointRotations"][:] = rotations
+        else:
+            back["jointRotations"][:] = front["jointRotations"]
+        
+        # joint and edge transforms in a single call to the compiled module if it is available
+        if quatmath is not None:
+            quatmath.update_transforms(back["jointPositions"], back["jointRotations"], self.jointPreRotation, self.edgePreRot, self.edgeParents, self.edgeChildren, 
+                                       self.skelRotation, self.skelPosition, back["jointTransforms"], back["edgeTransforms"], back["edgeLengths"])
+        else:
+            self.updateJointTransforms(back)
+            self.updateEdgeTransforms(back)
+        
+        self.swapState()
+        
+    def composeTransforms(self, rotations, positions, transforms):
+        
+        # transposed rotMat @ skelTransform @ transMat, assembled directly into the 4x4 matrices
+        # the last column and the last element are constant and already set in createState
+        if numba is not None:
+            rotMats = quat2mat_batch_nb(rotations, self._rotMatBuf[:rotations.shape[0]])
+        else:
+            rotMats = quat2mat_batch(rotations)
+        skelRotMat = self.skelRotation
+        skelPos = self.skelPosition
+        count = rotations.shape[0]
+        
+        rotSkelMats = np.matmul(rotMats, skelRotMat, out=self._skelRotMatBuf[:count])
+        transforms[:, :3, :3] = np.transpose(rotSkelMats, (0, 2, 1))
+        
+        skelPositions = np.matmul(positions, skelRotMat.T, out=self._posBuf[:count])
+        skelPositions += skelPos
+        np.einsum('nij,nj->ni', rotMats, skelPositions, out=transforms[:, 3, :3])
+        
+    def updateJointTransforms(self, state):
+        
+        if numba is not None:
+            jointRotations = qmult_batch_nb(self.jointPreRotation, state["jointRotations"], self._rotBuf[:self.jointCount])
+        else:
+            jointRotations = qmult_batch(self.jointPreRotation, state["jointRotations"])
+        
+        self.composeTransforms(jointRotations, state["jointPositions"], state["jointTransforms"])
 
-                edgeTransMat = t3d.affines.compose(edgePos, defaultRotMat, defaultScale)
-                
-                self.edgeLengths[eI] = edgeLength
-                
-                #self.edgeTransforms[eI] = np.transpose(np.matmul(edgeRotMat, edgeTransMat))
-                self.edgeTransforms[eI] = np.transpose(np.matmul(edgeRotMat, np.matmul(self.skelTransform, edgeTransMat)))
-                
-                eI += 1
+    def updateEdgeTransforms(self, state):
+        
+        jointPositions = state["jointPositions"]
+        parentJointPos = np.take(jointPositions, self.edgeParents, axis=0, out=self._edgeParentPosBuf)
+        childJointPos = np.take(jointPositions, self.edgeChildren, axis=0, out=self._edgeChildPosBuf)
+        
+        edgePos = np.add(parentJointPos, childJointPos, out=self._edgePosBuf)
+        edgePos *= 0.5
+        
+        # the edge vectors overwrite the child positions, which are not needed anymore
+        edgeVec = np.subtract(childJointPos, parentJointPos, out=childJointPos)
+        np.einsum('ij,ij->i', edgeVec, edgeVec, out=state["edgeLengths"])
+        np.sqrt(state["edgeLengths"], out=state["edgeLengths"])
+        
+        parentJointRot = np.take(state["jointRotations"], self.edgeParents, axis=0, out=self._edgeParentRotBuf)
+        if numba is not None:
+            edgeRotations = qmult_batch_nb(self.edgePreRot, parentJointRot, self._rotBuf[:self.edgeCount])
+        else:
+            edgeRotations = qmult_batch(self.edgePreRot, parentJointRot)
+        
+        self.composeTransforms(edgeRotations, edgePos, state["edgeTransforms"])
 
     def getJointCount(self):
         return self.jointCount
@@ -216,19 +437,23 @@ class Skeleton():
     def getEdgeCount(self):
         return self.edgeCount
     
+    # the front buffer with all arrays of the last update, only valid until the next refresh on the same thread
+    def getState(self):
+        return self._front
+    
     def getEdgeLengths(self):
-        return self.edgeLengths
+        return self._front["edgeLengths"]
     
     def getJointPositions(self):
-        return self.jointPositions
+        return self._front["jointPositions"]
     
     def getJointRotations(self):
-        return self.jointRotations
+        return self._front["jointRotations"]
     
     def getJointTransforms(self):
-        return self.jointTransforms
+        return self._front["jointTransforms"]
     
     def getEdgeTransforms(self):
-        return self.edgeTransforms
+        return self._front["edgeTransforms"]
     
     
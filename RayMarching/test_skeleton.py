@@ -0,0 +1,35 @@
+import json
+import os
+
+import numpy as np
+
+from skeleton import Skeleton, _Q_Z_HALF_PI, _Q_Y_HALF_PI
+
+
+def test_small_skeleton():
+    # fewer joints than the prerotation indices of the full mocap skeleton
+    skeleton = Skeleton([0, 1, 2, 3, 4], [[1], [2], [3, 4], [], []])
+    
+    assert skeleton.getJointCount() == 5
+    assert skeleton.getEdgeCount() == 4
+    np.testing.assert_allclose(skeleton.preRot[0], _Q_Z_HALF_PI)
+    np.testing.assert_allclose(skeleton.preRot[1:], np.tile([1.0, 0.0, 0.0, 0.0], (4, 1)))
+    
+    skeleton.setJointPositions(np.random.rand(5, 3))
+    skeleton.setJointRotations(np.random.rand(5, 4))
+    skeleton.refresh()
+    
+    assert np.all(np.isfinite(skeleton.getJointTransforms()))
+    assert np.all(np.isfinite(skeleton.getEdgeTransforms()))
+    assert skeleton.getEdgeLengths().shape == (4,)
+
+
+def test_full_skeleton_prerotations():
+    with open(os.path.join(os.path.dirname(__file__), "joint_settings.json")) as f:
+        joint_settings = json.load(f)
+    
+    skeleton = Skeleton(joint_settings["jointFilter"], joint_settings["jointConnectivity"])
+    
+    np.testing.assert_allclose(skeleton.preRot[[0, 6, 19]], np.tile(_Q_Z_HALF_PI, (3, 1)))
+    np.testing.assert_allclose(skeleton.preRot[[22, 27]], np.tile(_Q_Y_HALF_PI, (2, 1)))
+    np.testing.assert_allclose(skeleton.preRot[[1, 20, 21]], np.tile([1.0, 0.0, 0.0, 0.0], (3, 1)))
@@ -1,11 +1,10 @@
 import numpy as np
-import transforms3d as t3d
 import OpenGL.GL as gl
 import ctypes
 import logging
 import time
 
-from skeleton import Skeleton
+from skeleton import Skeleton, quat2mat_batch
 
 class Visualization():
     def __init__(self, skeleton, vertexCode, fragmentCode):
@@ -18,15 +17,15 @@ class Visualization():
         edgeCount = skeleton.getEdgeCount()
         groundCount = 1
         
-        self.skelPosition = np.array([0.0, 0.0, 0.0])
+        self.skelPosition = np.array([0.0, 0.0, 0.0], dtype=np.float32)
         
-        self.camPosition = np.array([1.0, 0.0, 0.0])
+        self.camPosition = np.array([1.0, 0.0, 0.0], dtype=np.float32)
         self.camAngle = 45.0
         
-        self.bgColor = np.array([0.0, 0.0, 0.0])
-        self.objectColor = np.array([1.0, 0.0, 0.0])
+        self.bgColor = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        self.objectColor = np.array([1.0, 0.0, 0.0], dtype=np.float32)
         
-        self.lightPosition = np.array([1.0, 0.0, 0.0])
+        self.lightPosition = np.array([1.0, 0.0, 0.0], dtype=np.float32)
         self.lightAmbientScale = 0.5
         self.lightDiffuseScale = 0.5
         self.lightSpecularScale = 0.5
@@ -36,25 +35,48 @@ class Visualization():
         self.lightOcclusionRange = 3.0
         self.lightOcclusinResolution = 1.0
         
-        self.jointPrimitives = np.zeros((jointCount), dtype=np.int32)
-        self.jointSizes = np.ones((jointCount, 3)) * 0.1
-        self.jointRoundings = np.ones((jointCount)) * 0.01
-        self.jointSmoothings = np.ones((jointCount)) * 0.01
-
-        self.edgePrimitives = np.zeros((edgeCount), dtype=np.int32)
-        self.edgeSizes = np.ones((edgeCount, 3))
+        # the joint and edge settings are views into the memory of the uniform blocks JointBlock and EdgeBlock of the shader
+        # std140 layout: a mat4 takes 16 floats, every other array element is padded to 4 floats
+        # the transforms come first, so that the settings can be uploaded without them when the skeleton didn't change
+        
+        # joint block: mat4 jointTransforms, int jointPrimitives, vec3 jointSizes, float jointRoundings, float jointSmoothings
+        self.jointBlock = np.zeros(jointCount * 32, dtype=np.float32)
+        self.jointBlockTransforms = self.jointBlock[:jointCount * 16].reshape(jointCount, 4, 4)
+        self.jointBlockSettingsOffset = jointCount * 16
+        self.jointPrimitives = self.jointBlock[jointCount * 16:jointCount * 20].view(np.int32).reshape(jointCount, 4)[:, 0]
+        self.jointSizes = self.jointBlock[jointCount * 20:jointCount * 24].reshape(jointCount, 4)[:, :3]
+        self.jointRoundings = self.jointBlock[jointCount * 24:jointCount * 28].reshape(jointCount, 4)[:, 0]
+        self.jointSmoothings = self.jointBlock[jointCount * 28:jointCount * 32].reshape(jointCount, 4)[:, 0]
+        
+        self.jointPrimitives[:] = 0
+        self.jointSizes[:] = 0.1
+        self.jointRoundings[:] = 0.01
+        self.jointSmoothings[:] = 0.01
+        
+        # edge block: mat4 edgeTransforms, float edgeLengths, int edgePrimitives, vec3 edgeSizes, float edgeRoundings, float edgeSmoothings
+        self.edgeBlock = np.zeros(edgeCount * 36, dtype=np.float32)
+        self.edgeBlockTransforms = self.edgeBlock[:edgeCount * 16].reshape(edgeCount, 4, 4)
+        self.edgeBlockLengths = self.edgeBlock[edgeCount * 16:edgeCount * 20].reshape(edgeCount, 4)[:, 0]
+        self.edgeBlockSettingsOffset = edgeCount * 20
+        self.edgePrimitives = self.edgeBlock[edgeCount * 20:edgeCount * 24].view(np.int32).reshape(edgeCount, 4)[:, 0]
+        self.edgeSizes = self.edgeBlock[edgeCount * 24:edgeCount * 28].reshape(edgeCount, 4)[:, :3]
+        self.edgeRoundings = self.edgeBlock[edgeCount * 28:edgeCount * 32].reshape(edgeCount, 4)[:, 0]
+        self.edgeSmoothings = self.edgeBlock[edgeCount * 32:edgeCount * 36].reshape(edgeCount, 4)[:, 0]
+
+        self.edgePrimitives[:] = 0
+        self.edgeSizes[:] = 1.0
         self.edgeSizes[:, 0] *= 0.01
         self.edgeSizes[:, 1] *= 0.01
         self.edgeSizes[:, 2] *= 1.0
-        self.edgeRoundings = np.ones((jointCount)) * 0.1
-        self.edgeSmoothings = np.ones((edgeCount)) * 0.01
+        self.edgeRoundings[:] = 0.1
+        self.edgeSmoothings[:] = 0.01
         self.jointEdgeSmoothing = 0.0
         
         self.groundPrimitive = 0
-        self.groundPosition = np.array([0.0, 0.0, 0.0])
-        self.groundRotation = np.array([1.0, 0.0, 0.0, 0.0])
-        self.groundTransform = np.eye(4)
-        self.groundSize = np.ones((3)) * 0.1
+        self.groundPosition = np.array([0.0, 0.0, 0.0], dtype=np.float32)
+        self.groundRotation = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+        self.groundTransform = np.eye(4, dtype=np.float32)
+        self.groundSize = np.full((3), 0.1, dtype=np.float32)
         self.groundRounding = 0.01
         self.groundSmoothing = 0.01
         
@@ -111,6 +133,25 @@ class Visualization():
         
         self.shader_jointEdgeSmoothing = gl.glGetUniformLocation(self.program, "jointEdgeSmoothing")
         
+        self.shader_groundPrimitive = gl.glGetUniformLocation(self.program, "groundPrimitive")
+        self.shader_groundTransform = gl.glGetUniformLocation(self.program, "groundTransform")
+        self.shader_groundSize = gl.glGetUniformLocation(self.program, "groundSize")
+        self.shader_groundRounding = gl.glGetUniformLocation(self.program, "groundRounding")
+        self.shader_groundSmoothing = gl.glGetUniformLocation(self.program, "groundSmoothing")
+        
+        # uniform buffers of the joint and edge blocks, on the binding points 0 and 1
+        # GLSL 330 has no binding layout qualifier, so the blocks are assigned to the binding points here
+        self.jointBlockBuffer = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.jointBlockBuffer)
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, self.jointBlock.nbytes, None, gl.GL_DYNAMIC_DRAW)
+        gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, 0, self.jointBlockBuffer)
+        gl.glUniformBlockBinding(self.program, gl.glGetUniformBlockIndex(self.program, "JointBlock"), 0)
+        
+        self.edgeBlockBuffer = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.edgeBlockBuffer)
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, self.edgeBlock.nbytes, None, gl.GL_DYNAMIC_DRAW)
+        gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, 1, self.edgeBlockBuffer)
+        gl.glUniformBlockBinding(self.program, gl.glGetUniformBlockIndex(self.program, "EdgeBlock"), 1)
 
         gl.glDetachShader(self.program, self.vertex)
         gl.glDetachShader(self.program, self.fragment)
@@ -143,6 +184,9 @@ class Visualization():
         
         
         self.start_time = time.time() 
+        
+        # the new program has no skeleton uniforms yet
+        self.skeletonVersion = -1
     
     def render(self, gl):
         gl.glUseProgram(self.program)
@@ -154,12 +198,12 @@ class Visualization():
         gl.glUniform1f(self.shader_iGlobalTime, elapsed_time)
         gl.glUniform2f(self.shader_iResolution, *self.resolution)
         
-        gl.glUniform3f(self.shader_camPosition, *self.camPosition.tolist())
+        gl.glUniform3fv(self.shader_camPosition, 1, self.camPosition)
         gl.glUniform1f(self.shader_camAngle, self.camAngle);
 
-        gl.glUniform3f(self.shader_bgColor, *self.bgColor.tolist())
-        gl.glUniform3f(self.shader_objectColor, *self.objectColor.tolist())
-        gl.glUniform3f(self.shader_lightPosition, *self.lightPosition.tolist())
+        gl.glUniform3fv(self.shader_bgColor, 1, self.bgColor)
+        gl.glUniform3fv(self.shader_objectColor, 1, self.objectColor)
+        gl.glUniform3fv(self.shader_lightPosition, 1, self.lightPosition)
         
         gl.glUniform1f(self.shader_lightAmbientScale, self.lightAmbientScale)
         gl.glUniform1f(self.shader_lightDiffuseScale, self.lightDiffuseScale)
@@ -172,129 +216,64 @@ class Visualization():
         
         gl.glUniform1f(self.shader_jointEdgeSmoothing, self.jointEdgeSmoothing)
 
-        jointCount = self.skeleton.getJointCount()
-        edgeCount = self.skeleton.getEdgeCount()
+        # joints and edges from the same skeleton update
+        skeletonState = self.skeleton.getState()
         
-        jointTransforms = np.copy(self.skeleton.getJointTransforms())
-        edgeTransforms = np.copy(self.skeleton.getEdgeTransforms())
-        edgeLengths = np.copy(self.skeleton.getEdgeLengths())
-
-        # joint transforms
-        for jI in range(jointCount):
-            
-            jointTransform = jointTransforms[jI]
-            
-            uniformName = "jointTransforms[" + str(jI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniformMatrix4fv(uniformLoc, 1, gl.GL_FALSE, jointTransform.tolist ())
-            
-        # joint primitives
-        for jI in range(jointCount):
-            
-            jointPrimitive = self.jointPrimitives[jI]
-            uniformName = "jointPrimitives[" + str(jI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1i(uniformLoc, jointPrimitive)
+        # uniforms keep their values between frames, so the skeleton transforms are only uploaded after the skeleton changed
+        skeletonChanged = skeletonState["version"] != self.skeletonVersion
+        self.skeletonVersion = skeletonState["version"]
         
-        # joint sizes
-        for jI in range(jointCount):
-            
-            jointSize = self.jointSizes[jI]
-            uniformName = "jointSizes[" + str(jI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform3fv(uniformLoc, 1, jointSize.tolist())
-            
-        # joint rounding
-        for jI in range(jointCount):
-            
-            jointRounding = self.jointRoundings[jI]
-            uniformName = "jointRoundings[" + str(jI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1f(uniformLoc, jointRounding)
-                
-        # joint smooths
-        for jI in range(jointCount):
-            
-            jointSmooth = self.jointSmoothings[jI]
-            uniformName = "jointSmoothings[" + str(jI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1f(uniformLoc, jointSmooth)
-            
-        # edge transforms
-        for eI in range(edgeCount):
-            
-            edgeTransform = edgeTransforms[eI]
-            uniformName = "edgeTransforms[" + str(eI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniformMatrix4fv(uniformLoc, 1, gl.GL_FALSE, edgeTransform.tolist ())
-            
-        # edge primitives
-        for eI in range(edgeCount):
-            
-            edgePrimitive = self.edgePrimitives[eI]
-            uniformName = "edgePrimitives[" + str(eI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1i(uniformLoc, edgePrimitive)
-            
-        # edge lengths
-        for eI in range(edgeCount):
-
-            edgeLength = edgeLengths[eI]
-            uniformName = "edgeLengths[" + str(eI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1f(uniformLoc, edgeLength)
-            
-        # edge sizes
-        for eI in range(edgeCount):
+        # no copies needed, the skeleton only writes into its back buffer and the front buffer is read once per frame below
+        jointTransforms = skeletonState["jointTransforms"]
+        edgeTransforms = skeletonState["edgeTransforms"]
+        edgeLengths = skeletonState["edgeLengths"]
 
-            edgeSize = self.edgeSizes[eI]
-            uniformName = "edgeSizes[" + str(eI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform3fv(uniformLoc, 1, edgeSize.tolist())
- 
-        # edge rounding
-        for eI in range(edgeCount):
-            
-            edgeRounding = self.edgeRoundings[eI]
-            uniformName = "edgeRoundings[" + str(eI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1f(uniformLoc, edgeRounding)           
- 
-        # edge smooths
-        for eI in range(edgeCount):
-            
-            edgeSmooth = self.edgeSmoothings[eI]
-            uniformName = "edgeSmoothings[" + str(eI) + "]";
-            uniformLoc = gl.glGetUniformLocation(self.program, uniformName)
-            gl.glUniform1f(uniformLoc, edgeSmooth)
+        # joint and edge blocks, one glBufferSubData each
+        # the transforms are only copied and uploaded after the skeleton changed, otherwise the upload starts at the settings
+        if skeletonChanged:
+            self.jointBlockTransforms[:] = jointTransforms
+            self.edgeBlockTransforms[:] = edgeTransforms
+            self.edgeBlockLengths[:] = edgeLengths
+            jointBlockStart = 0
+            edgeBlockStart = 0
+        else:
+            jointBlockStart = self.jointBlockSettingsOffset
+            edgeBlockStart = self.edgeBlockSettingsOffset
+        
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.jointBlockBuffer)
+        gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, jointBlockStart * self.jointBlock.itemsize, self.jointBlock[jointBlockStart:].nbytes, self.jointBlock[jointBlockStart:])
+        
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.edgeBlockBuffer)
+        gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, edgeBlockStart * self.edgeBlock.itemsize, self.edgeBlock[edgeBlockStart:].nbytes, self.edgeBlock[edgeBlockStart:])
 
 
         # ground settings
         
-        gl.glUniform1i(gl.glGetUniformLocation(self.program, "groundPrimitive"), self.groundPrimitive)
-        gl.glUniformMatrix4fv(gl.glGetUniformLocation(self.program, "groundTransform"), 1, gl.GL_FALSE, self.groundTransform.tolist())
-        gl.glUniform3fv(gl.glGetUniformLocation(self.program, "groundSize"), 1, self.groundSize.tolist())
-        gl.glUniform1f(gl.glGetUniformLocation(self.program, "groundRounding"), self.groundRounding)     
-        gl.glUniform1f(gl.glGetUniformLocation(self.program, "groundSmoothing"), self.groundSmoothing)     
+        gl.glUniform1i(self.shader_groundPrimitive, self.groundPrimitive)
+        gl.glUniformMatrix4fv(self.shader_groundTransform, 1, gl.GL_FALSE, self.groundTransform)
+        gl.glUniform3fv(self.shader_groundSize, 1, self.groundSize)
+        gl.glUniform1f(self.shader_groundRounding, self.groundRounding)     
+        gl.glUniform1f(self.shader_groundSmoothing, self.groundSmoothing)     
 
 
         gl.glDrawArrays(gl.GL_TRIANGLE_STRIP, 0, 4)        
         
         
+    # vector settings are stored as contiguous float32 arrays, so render passes them to OpenGL without conversion
     def setBGColor(self, bgColor):
-        self.bgColor = bgColor
+        self.bgColor = np.ascontiguousarray(bgColor, dtype=np.float32)
         
     def setObjectColor(self, objectColor):
-        self.objectColor = objectColor
+        self.objectColor = np.ascontiguousarray(objectColor, dtype=np.float32)
         
     def setCamPosition(self, camPosition):
-        self.camPosition = camPosition
+        self.camPosition = np.ascontiguousarray(camPosition, dtype=np.float32)
         
     def setCamAngle(self, camAngle):
         self.camAngle = camAngle
         
     def setLightPosition(self, position):
-        self.lightPosition = position
+        self.lightPosition = np.ascontiguousarray(position, dtype=np.float32)
         
     def setLightAmbientScale(self, scale):
         self.lightAmbientScale = scale
@@ -413,31 +392,29 @@ class Visualization():
         self.groundPrimitive = primitive    
 
     def setGroundPosition(self, position):
-        self.groundPosition = position    
+        self.groundPosition = np.ascontiguousarray(position, dtype=np.float32)    
         
         self.updateGroundTransform()
  
     def setGroundRotation(self, rotation):
-        self.groundRotation = rotation    
+        self.groundRotation = np.ascontiguousarray(rotation, dtype=np.float32)    
         
         self.updateGroundTransform()       
  
     def updateGroundTransform(self):
         
-        defaultScale = np.ones((3))
-        defaultRot = np.array([1.0, 0.0, 0.0, 0.0])
-        defaultPos = np.array([0.0, 0.0, 0.0])
-        defaultRotMat = (t3d.quaternions.quat2mat(defaultRot))
+        # rotation applied after the translation: [R, R @ position; 0, 1], stored transposed like the joint transforms
+        groundRotMat = quat2mat_batch(self.groundRotation.reshape(1, 4))[0]
         
-        groundRotMat = t3d.quaternions.quat2mat(self.groundRotation)
-        groundTransMat = t3d.affines.compose(self.groundPosition, defaultRotMat, defaultScale)
-        groundRotMat = t3d.affines.compose(defaultPos, groundRotMat, defaultScale)
+        groundTransform = np.eye(4, dtype=np.float32)
+        groundTransform[:3, :3] = groundRotMat.T
+        groundTransform[3, :3] = np.matmul(groundRotMat, self.groundPosition)
 
-        self.groundTransform = np.transpose(np.matmul(groundRotMat, groundTransMat))
+        self.groundTransform = groundTransform
 
     def setGroundSize(self, size):
         
-        self.groundSize = size
+        self.groundSize = np.ascontiguousarray(size, dtype=np.float32)
         
     def setGroundRounding(self, round):
         